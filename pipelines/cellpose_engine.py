@@ -0,0 +1,251 @@
+import glob
+import hashlib
+from importlib import metadata
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+import numpy as np
+
+##################################################
+######### CELLPOSE ENGINE MAIN FUNCTION  #########
+##################################################
+
+# Segments a single TIF with a pretrained Cellpose model and saves the mask PNG to outpath.
+# Shared by the segmentation and cellprofiler pipelines. cellpose_mode selects how Cellpose is run:
+# 'subprocess' (default) runs the Cellpose CLI on a temporary directory, as the pipelines always have;
+# 'inprocess' segments the image in this process with a model that is loaded once and kept for the whole run.
+# ('plate' mode runs segment_cellpose_plate() once for all well_sites instead.)
+# Both modes write the same uint16 mask PNG. Returns outpath, or None if Cellpose produced no mask.
+# If cache_dir is given, a mask cached for the same image content, model and Cellpose settings is reused instead.
+# Called in segmentation() and cellprofiler()
+def segment_cellpose(model_path, tiff_file, outpath, cellpose_mode='subprocess', cache_dir=None):
+    if cache_dir is not None:
+        cache_key = cellpose_cache_key(model_path, tiff_file)
+        if read_cellpose_cache(cache_dir, cache_key, outpath):
+            print(f"Using cached Cellpose mask for {Path(tiff_file).name}.")
+            return outpath
+        outpath = segment_cellpose(model_path, tiff_file, outpath, cellpose_mode)
+        if outpath is not None:
+            write_cellpose_cache(cache_dir, cache_key, outpath)
+        return outpath
+
+    if cellpose_mode == 'inprocess':
+        return run_cellpose_in_process(model_path, tiff_file, outpath)
+    if cellpose_mode != 'subprocess':
+        raise ValueError(f"Unsupported cellpose_mode: {cellpose_mode}. Use 'subprocess' or 'inprocess'.")
+
+    # CellPose requires images to be in a directory for processing.
+    # A temporary directory is chosen as it is automatically cleaned up after use
+    with tempfile.TemporaryDirectory() as temp_dir:
+
+        # Rename the TIF file to .tif as Cellpose also requires images to be in .tif format.
+        rename_file_to_tif(tiff_file, temp_dir)
+
+        # Run CellPose to segment the image
+        run_cellpose(model_path, temp_dir)
+
+        # Rename and move the resulting PNG mask to outpath
+        for file in glob.glob(f"{temp_dir}/*.png"):
+            if "cp_masks" in file:
+                shutil.copy(file, outpath)
+                return outpath
+    return None
+
+
+# Plate-level Cellpose run (cellpose_mode: 'plate'). Links the given TIFs into one staging directory under work_dir,
+# runs the Cellpose CLI once over all of them, and copies each *_cp_masks.png to its output paths.
+# tiff_outpaths maps each source TIF path to a list of mask output paths (a single-wavelength .TIF is shared by every
+# wavelength). Returns the output paths that received a mask.
+# If cache_dir is given, images with a cached mask are not staged and the new masks are added to the cache.
+# Called in segmentation_cellpose_plate() and cellprofiler_cellpose_plate()
+def segment_cellpose_plate(model_path, tiff_outpaths, work_dir, cache_dir=None):
+    Path(work_dir).mkdir(parents=True, exist_ok=True)
+    written = []
+
+    cache_keys = {}
+    if cache_dir is not None:
+        uncached = {}
+        for tiff_file, outpaths in tiff_outpaths.items():
+            cache_key = cellpose_cache_key(model_path, tiff_file)
+            for outpath in outpaths:
+                if read_cellpose_cache(cache_dir, cache_key, outpath):
+                    written.append(outpath)
+                else:
+                    uncached.setdefault(tiff_file, []).append(outpath)
+                    cache_keys[tiff_file] = cache_key
+        tiff_outpaths = uncached
+        print(f"Using {len(written)} cached Cellpose masks.")
+        if not tiff_outpaths:
+            return written
+
+    # The staging directory lives in work_dir so that hard links stay on the same filesystem
+    with tempfile.TemporaryDirectory(dir=work_dir, prefix='cellpose_staging_') as staging_dir:
+        staged = {}
+        for tiff_file, outpaths in tiff_outpaths.items():
+            staged_file = link_file_as_tif(tiff_file, staging_dir)
+            staged[staged_file.stem] = (tiff_file, outpaths)
+
+        print(f"Running Cellpose once on {len(staged)} images.")
+        run_cellpose(model_path, staging_dir)
+
+        # Fan the masks back out to the per-well output names
+        for stem, (tiff_file, outpaths) in staged.items():
+            mask_file = Path(staging_dir) / f"{stem}_cp_masks.png"
+            if mask_file.exists():
+                for outpath in outpaths:
+                    shutil.copy(str(mask_file), str(outpath))
+                    written.append(outpath)
+                if tiff_file in cache_keys:
+                    write_cellpose_cache(cache_dir, cache_keys[tiff_file], outpaths[0])
+            else:
+                print(f"No Cellpose mask found for {stem}.")
+    return written
+
+
+#####################################################
+######### CELLPOSE ENGINE HELPER FUNCTIONS  #########
+#####################################################
+
+# This function renames a .TIF file as .tif.
+# This is necessary because CellPose requires images to be in a directory and in .tif format for processing.
+# Called in segment_cellpose()
+def rename_file_to_tif(src_file, temp_dir):
+    temp_file = Path(temp_dir) / (Path(src_file).stem + ".tif")
+    shutil.copy(src_file, temp_file)
+    return temp_file
+
+
+# Links a .TIF file into the staging directory under a .tif name (Cellpose only reads lowercase .tif).
+# Uses a symbolic link, then a hard link, and only copies the file if the filesystem supports neither.
+# Called in segment_cellpose_plate()
+def link_file_as_tif(src_file, staging_dir):
+    staged_file = Path(staging_dir) / (Path(src_file).stem + ".tif")
+    try:
+        os.symlink(os.path.abspath(src_file), staged_file)
+    except OSError:
+        try:
+            os.link(src_file, staged_file)
+        except OSError:
+            shutil.copy(src_file, staged_file)
+    return staged_file
+
+
+# This function runs the CellPose segmentation model on .tif images in a given directory.
+# Called in segment_cellpose() and segment_cellpose_plate()
+def run_cellpose(model_path, temp_dir):
+    cellpose_command = (
+        f"python -m cellpose "
+        f"--dir {temp_dir} "
+        f"--pretrained_model {model_path} "
+        f"--diameter 0 --save_png --no_npy --verbose"
+    )
+    cellpose_command_split = shlex.split(cellpose_command)
+    subprocess.run(cellpose_command_split)
+
+
+# Loaded Cellpose models kept for the lifetime of the process (each worker process has its own), keyed by model path
+CELLPOSE_MODELS = {}
+
+
+# Returns the Cellpose model for model_path, loading it on first use.
+# cellpose (and torch) are imported here so that the 'subprocess' mode never imports them into the pipeline process.
+# Called in run_cellpose_in_process()
+def get_cellpose_model(model_path):
+    key = str(model_path)
+    if key not in CELLPOSE_MODELS:
+        from cellpose import models
+        print(f"Loading Cellpose model {Path(key).name}.")
+        CELLPOSE_MODELS[key] = models.CellposeModel(gpu=False, pretrained_model=key)
+    return CELLPOSE_MODELS[key]
+
+
+# Segments an image array with a loaded Cellpose model using the same settings as the CLI call in run_cellpose():
+# grayscale channels [0, 0] and --diameter 0, which for a custom model means the model's own training diameter.
+# Called in run_cellpose_in_process()
+def cellpose_masks(model, image):
+    masks, _, _ = model.eval(image, channels=[0, 0], diameter=model.diam_labels)
+    return masks
+
+
+# Reads a TIF and writes its Cellpose mask PNG in this process. The image is read and the mask is written with
+# cellpose.io, as the CLI does, so the PNG is identical to the CLI's *_cp_masks.png.
+# Called in segment_cellpose()
+def run_cellpose_in_process(model_path, tiff_file, outpath):
+    from cellpose import io
+
+    model = get_cellpose_model(model_path)
+    masks = cellpose_masks(model, io.imread(str(tiff_file)))
+
+    # The CLI only saves PNG masks when the labels fit in 16 bits
+    if masks.max() >= 2**16:
+        print(f"Too many masks in {Path(tiff_file).name} to save as PNG. Skipping.")
+        return None
+    io.imsave(str(outpath), masks.astype(np.uint16))
+    return outpath
+
+
+# Returns the Cellpose mask cache directory shared by all pipelines ('work/cellpose_cache'), or None if the pipeline's
+# cellpose_cache option is off.
+# Called in segmentation(), cellprofiler() and their plate-level Cellpose functions
+def cellpose_cache_dir(g, options):
+    return Path(g.work) / 'cellpose_cache' if options.get('cellpose_cache', True) else None
+
+
+# Cellpose settings used by run_cellpose() and cellpose_masks(). Part of the mask cache key, so changing them
+# (or upgrading Cellpose) never reuses masks made with other settings.
+CELLPOSE_PARAMS = "diameter=0;channels=0,0"
+
+# SHA-256 of each model file, keyed by (path, size, modification time) so each model is hashed once per process
+MODEL_HASHES = {}
+
+
+# Returns the SHA-256 hex digest of a file's contents, read in 1 MB chunks.
+# Called in cellpose_cache_key()
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Returns the mask cache key of an image: a hash of the image content, the model file content, the Cellpose settings
+# and the installed Cellpose version.
+# Called in segment_cellpose() and segment_cellpose_plate()
+def cellpose_cache_key(model_path, tiff_file):
+    stat = os.stat(model_path)
+    model_key = (str(model_path), stat.st_size, stat.st_mtime_ns)
+    if model_key not in MODEL_HASHES:
+        MODEL_HASHES[model_key] = file_sha256(model_path)
+
+    try:
+        cellpose_version = metadata.version('cellpose')
+    except metadata.PackageNotFoundError:
+        cellpose_version = 'unknown'
+
+    key = f"{file_sha256(tiff_file)};{MODEL_HASHES[model_key]};{CELLPOSE_PARAMS};cellpose={cellpose_version}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+# Copies the cached mask for cache_key to outpath. Returns False if there is no cached mask.
+# Called in segment_cellpose() and segment_cellpose_plate()
+def read_cellpose_cache(cache_dir, cache_key, outpath):
+    cached = Path(cache_dir) / f"{cache_key}.png"
+    if not cached.exists():
+        return False
+    shutil.copy(cached, outpath)
+    return True
+
+
+# Adds a mask to the cache. The mask is copied to a temporary name first and then renamed, so parallel runs never see
+# a partly written cache entry.
+# Called in segment_cellpose() and segment_cellpose_plate()
+def write_cellpose_cache(cache_dir, cache_key, mask_path):
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    cached = Path(cache_dir) / f"{cache_key}.png"
+    temp_path = Path(cache_dir) / f"{cache_key}.{os.getpid()}.tmp"
+    shutil.copy(mask_path, temp_path)
+    os.replace(temp_path, cached)
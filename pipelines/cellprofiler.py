@@ -1,14 +1,15 @@
-import glob
 import os
-import shutil
 import shlex
 import subprocess
-import tempfile
 from pathlib import Path
+import pandas as pd
 
 from config import get_program_dir
 PROGRAM_DIR = get_program_dir()
 
+from pipelines.cellpose_engine import cellpose_cache_dir, segment_cellpose, segment_cellpose_plate
+from preprocessing.utilities import get_timepoints, timepoint_suffix
+
 ###############################################
 ######### CELLPROFILER MAIN FUNCTION  #########
 ###############################################
@@ -26,7 +27,7 @@ def cellprofiler(g, options, well_site):
     model_path = PROGRAM_DIR / "pipelines" / "models" / "cellpose" / options['cellpose_model'] if options['cellpose_model'] else None
     wavelength_option = options["cellpose_wavelength"]  # A single wavelength like 'w1'
     wavelength = int(wavelength_option[1:]) - 1  # Convert 'w1' to zero-based index
-    timepoints = range(1, 2)  # Process only TimePoint_1 for now
+    timepoints = get_cellprofiler_timepoints(g, options)
 
     if options['cellpose_model'] != None:
         for timepoint in timepoints:
@@ -38,21 +39,12 @@ def cellprofiler(g, options, well_site):
                 print(f"No TIF file found for well site {well_site} for timepoint {timepoint}. Skipping to next timepoint.")
                 continue                                         
 
-            # CellPose requires images to be in a directory for processing.
-            # A temporary directory is chosen as it is automatically cleaned up after use
-            with tempfile.TemporaryDirectory() as temp_dir:
-                
-                # Rename the TIF file to .tif as Cellpose also requires images to be in .tif format.
-                rename_file_to_tif(tiff_file, temp_dir)
-
-                # Run CellPose to segment the images for the current timepoint and wavelength
-                run_cellpose(model_path, temp_dir)
-
-                # Rename and move the resulting PNG mask to the 'work/cellprofiler' directory
-                for file in glob.glob(f"{temp_dir}/*.png"):
-                    if "cp_masks" in file:
-                            new_filename = (f"{g.plate}_{well_site}_w{wavelength + 1}.png")
-                            shutil.copy(file, work_dir / new_filename)
+            # Run CellPose to segment the image and save the PNG mask to the 'work/cellprofiler' directory
+            # (in 'plate' mode the masks of all well_sites were already made by cellprofiler_cellpose_plate())
+            new_filename = f"{g.plate}_{well_site}_w{wavelength + 1}{timepoint_suffix(timepoint)}.png"
+            cellpose_mode = options.get('cellpose_mode', 'subprocess')
+            if cellpose_mode != 'plate':
+                segment_cellpose(model_path, tiff_file, work_dir / new_filename, cellpose_mode, cellpose_cache_dir(g, options))
 
     # Generate the CSV file using the R script
     run_rscript_to_generate_csv(
@@ -67,38 +59,99 @@ def cellprofiler(g, options, well_site):
     )
 
     # Run CellProfiler and save the output images to the output/cellprofiler/img directory
-    csv_file = (
-        work_dir / f"image_paths_{g.plate}_{well_site}_w{wavelength + 1}.csv"
-    )
-    if csv_file.exists():
-        run_cellprofiler(options["pipeline"], csv_file, img_out_dir)
-    else:
-        print(f"CSV file not found: {csv_file}")
+    # (in 'plate' mode CellProfiler is run once on the file lists of all well_sites by cellprofiler_plate())
+    if not cellprofiler_plate_mode(options):
+        csv_file = (
+            work_dir / f"image_paths_{g.plate}_{well_site}_w{wavelength + 1}.csv"
+        )
+        if csv_file.exists():
+            run_cellprofiler(options["pipeline"], csv_file, img_out_dir)
+        else:
+            print(f"CSV file not found: {csv_file}")
 
     return [wavelength]
 
 
+# Plate-level Cellpose segmentation for CellProfiler (cellpose_mode: 'plate'). Runs Cellpose over the images of all
+# well_sites for the cellpose_wavelength (once per timepoint, as the images of different timepoints share their file
+# names) and saves each mask under its per-well name in 'work/cellprofiler'.
+# Called in wrapper.py before the well_site loop
+def cellprofiler_cellpose_plate(g, options, well_sites):
+    work_dir = Path(g.work) / "cellprofiler"
+    if not options['cellpose_model']:
+        return
+    model_path = PROGRAM_DIR / "pipelines" / "models" / "cellpose" / options['cellpose_model']
+    wavelength = int(options["cellpose_wavelength"][1:]) - 1
+
+    for timepoint in get_cellprofiler_timepoints(g, options):
+        tiff_outpaths = {}
+        for well_site in well_sites:
+            tiff_file_base = os.path.join(g.input, g.plate, f"TimePoint_{timepoint}", f"{g.plate_short}_{well_site}")
+            tiff_file = next((f for f in (f"{tiff_file_base}_w{wavelength + 1}.TIF", f"{tiff_file_base}.TIF") if os.path.exists(f)), None)
+            if tiff_file is not None:
+                tiff_outpaths.setdefault(tiff_file, []).append(work_dir / f"{g.plate}_{well_site}_w{wavelength + 1}{timepoint_suffix(timepoint)}.png")
+
+        segment_cellpose_plate(model_path, tiff_outpaths, work_dir, cellpose_cache_dir(g, options))
+
+
+# Plate-level CellProfiler run (cellprofiler_mode: 'plate'). Combines the file lists that cellprofiler() generated for
+# each well_site into one list and runs CellProfiler once for the whole plate, so the CellProfiler startup and pipeline
+# load are paid once instead of once per well_site. Only used for pipelines whose ExportToSpreadsheet file names contain
+# the Well metadata, so CellProfiler still writes one result CSV per well (see cellprofiler_plate_mode()).
+# Called in wrapper.py after the well_site loop
+def cellprofiler_plate(g, options, well_sites):
+    if not cellprofiler_plate_mode(options):
+        return
+    work_dir = Path(g.work) / "cellprofiler"
+    img_out_dir = Path(g.output) / "cellprofiler" / "img"
+    wavelength = int(options["cellpose_wavelength"][1:]) - 1
+
+    csv_files = [work_dir / f"image_paths_{g.plate}_{well_site}_w{wavelength + 1}.csv" for well_site in well_sites]
+    csv_files = [csv_file for csv_file in csv_files if csv_file.exists()]
+    if not csv_files:
+        print(f"No CellProfiler file lists found for plate {g.plate}.")
+        return
+
+    csv_file = combine_file_lists(csv_files, work_dir / f"image_paths_{g.plate}_w{wavelength + 1}.csv")
+    run_cellprofiler(options["pipeline"], csv_file, img_out_dir)
+
 ##################################################
 ######### CELLPROFILER HELPER FUNCTIONS  #########
 ##################################################
 
-# This function renames a .TIF file as .tif.  
-# This is necessary because CellPose requires images to be in a directory and in .tif format for processing.
-def rename_file_to_tif(src_file, temp_dir):
-    temp_file = Path(temp_dir) / (Path(src_file).stem + ".tif")
-    shutil.copy(src_file, temp_file)
-    return temp_file
-
-# This function runs the CellPose segmentation model on .tif images in a given directory.  
-def run_cellpose(model_path, temp_dir):
-    cellpose_command = (
-        f"python -m cellpose "
-        f"--dir {temp_dir} "
-        f"--pretrained_model {model_path} "
-        f"--diameter 0 --save_png --no_npy --verbose"
-    )
-    cellpose_command_split = shlex.split(cellpose_command)
-    subprocess.run(cellpose_command_split)
+# Whether each CellProfiler pipeline exports its results per well, keyed by pipeline name
+PER_WELL_EXPORTS = {}
+
+
+# Returns True if CellProfiler should run once per plate: cellprofiler_mode is 'plate' and every spreadsheet the
+# pipeline exports is named with the Well metadata (\g<Well>). Pipelines that export a single plate-level file
+# (e.g. \g<Plate>_data.csv in wormsize, wormsize_intensity and wormsize_trans) keep running per well_site.
+# Called in cellprofiler() and cellprofiler_plate()
+def cellprofiler_plate_mode(options):
+    if options.get('cellprofiler_mode', 'well') != 'plate':
+        return False
+
+    pipeline = options["pipeline"]
+    if pipeline not in PER_WELL_EXPORTS:
+        pipeline_path = PROGRAM_DIR / "pipelines" / "cellprofiler" / f"{pipeline}.cppipe"
+        with open(pipeline_path, errors='replace') as f:
+            export_names = [line.split(':', 1)[1] for line in f if line.strip().startswith('File name:') and '.csv' in line]
+        PER_WELL_EXPORTS[pipeline] = bool(export_names) and all('\\g<Well>' in name for name in export_names)
+        if not PER_WELL_EXPORTS[pipeline]:
+            print(f"CellProfiler pipeline {pipeline} does not export results per well; running it per well_site instead of per plate.")
+    return PER_WELL_EXPORTS[pipeline]
+
+
+# Returns the timepoints to segment with Cellpose: TimePoint_1 (timepoints: 1, the default) or every timepoint
+# ('All'). The R file lists pair every raw image of a well (all TimePoint folders) with the masks of the well in
+# sorted order, so any other selection would pair images with the wrong masks.
+# Called in cellprofiler() and cellprofiler_cellpose_plate()
+def get_cellprofiler_timepoints(g, options):
+    timepoints = get_timepoints(g, options.get('timepoints', 1))
+    if timepoints not in ([1], list(range(1, g.time_points + 1))):
+        raise ValueError("CellProfiler timepoints must be 1 or 'All'.")
+    return timepoints
+
 
 # This function runs an R script to generate a CSV file listing image paths.  
 # The CSV is required by CellProfiler to know which images to analyze and where to find them.
@@ -125,3 +178,17 @@ def run_cellprofiler(cellprofiler_pipeline, csv_file, img_out_dir):
     cp_command = f"cellprofiler -c -r -p {pipeline_path} --data-file={csv_file} --output-dir={img_out_dir}"
     print(f"Running CellProfiler using {csv_file.name}.")
     subprocess.run(shlex.split(cp_command))
+
+
+# Concatenates per-well CellProfiler file lists into one CSV at outpath. Values are copied as text so the list is
+# identical to the R output apart from Group_Index, which is renumbered to run over the combined list.
+# Called in cellprofiler_plate()
+def combine_file_lists(csv_files, outpath):
+    file_list = pd.concat(
+        [pd.read_csv(csv_file, dtype=str, keep_default_na=False) for csv_file in csv_files], ignore_index=True
+    )
+    if 'Group_Index' in file_list.columns:
+        file_list['Group_Index'] = range(1, len(file_list) + 1)
+    file_list.to_csv(outpath, index=False)
+    print(f"Combined {len(csv_files)} file lists into {Path(outpath).name}.")
+    return Path(outpath)
@@ -0,0 +1,132 @@
+import cv2
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+from preprocessing.heatmap import save_motility_heatmap
+from preprocessing.motion import noise_level, pair_differences
+from preprocessing.roi import get_flow_roi
+
+###################################################
+######### FRAME DIFFERENCE MAIN FUNCTION  #########
+###################################################
+
+# This main function computes a fast motility metric from thresholded absolute differences between consecutive timepoints.
+# Frames are streamed in chunks and the differences are computed in one vectorised pass over each chunk.
+# The metric is the total number of pixels that changed by more than the threshold across all frame pairs.
+# Output matches optical_flow: a heatmap PNG and a CSV per well_site and wavelength in 'work/frame_difference'.
+def frame_difference(g, options, well_site, multiplier=2):
+    # Create work and output directories
+    work_dir = Path(g.work) / 'frame_difference'
+    output_dir = Path(g.output) / 'frame_difference'
+    work_dir.mkdir(parents=True, exist_ok=True)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    wavelengths = get_frame_difference_wavelengths(g, options)
+
+    diff_threshold = options.get('diff_threshold', 'auto')
+    chunk_size = max(1, int(options.get('chunk_size', 16)))
+    roi = options.get('roi', 'none')
+
+    # Loop through all wavelengths
+    for wavelength in wavelengths:
+        # Read first frame and restrict to the region of interest if requested
+        frame1_path = Path(g.plate_dir) / 'TimePoint_1' / f'{g.plate_short}_{well_site}_w{wavelength + 1}.TIF'
+        frame1 = cv2.imread(str(frame1_path), cv2.IMREAD_ANYDEPTH)
+        height, width = frame1.shape
+        (y0, y1, x0, x1), roi_mask = get_flow_roi(g, frame1, roi)
+
+        # Chunk buffer: slot 0 holds the last frame of the previous chunk
+        buffer = np.empty((chunk_size + 1, y1 - y0, x1 - x0), dtype=np.int32)
+        buffer[0] = frame1[y0:y1, x0:x1]
+        moving_count = np.zeros((y1 - y0, x1 - x0), dtype=np.uint32)
+
+        # The automatic threshold is shared by all wells of the plate so that their totals can be compared
+        threshold = diff_threshold
+        if threshold == 'auto':
+            threshold = DIFF_THRESHOLDS.get((g.plate, wavelength))
+            if threshold is None:
+                print(f"No plate threshold estimated, estimating the frame difference threshold from {well_site} only.")
+                threshold = estimate_diff_threshold(g, options, [well_site], wavelength)
+
+        # Stream the remaining timepoints in chunks
+        for chunk_start in range(2, g.time_points + 1, chunk_size):
+            chunk_timepoints = range(chunk_start, min(chunk_start + chunk_size, g.time_points + 1))
+            for i, timepoint in enumerate(chunk_timepoints, start=1):
+                frame_path = Path(g.plate_dir) / f'TimePoint_{timepoint}' / f'{g.plate_short}_{well_site}_w{wavelength + 1}.TIF'
+                buffer[i] = cv2.imread(str(frame_path), cv2.IMREAD_ANYDEPTH)[y0:y1, x0:x1]
+            stack = buffer[:len(chunk_timepoints) + 1]
+
+            # Absolute differences between consecutive frames in the chunk
+            diffs = np.abs(np.diff(stack, axis=0))
+
+            moving = diffs > threshold
+            if roi_mask is not None:
+                moving &= roi_mask
+            moving_count += moving.sum(axis=0, dtype=np.uint32)
+
+            buffer[0] = stack[-1]
+
+        total_moving = int(moving_count.sum())
+
+        # Place the per-pixel counts back into a full-size image and save the heatmap in 'work/frame_difference'
+        sum_img = np.zeros((height, width), dtype=np.float32)
+        sum_img[y0:y1, x0:x1] = moving_count
+        outpath = work_dir / f'{g.plate}_{well_site}_w{wavelength + 1}.png'
+        save_motility_heatmap(sum_img, outpath, multiplier)
+
+        # Write the results for the current well_site and wavelength to CSV
+        df = pd.DataFrame([{'well_site': well_site, 'frame_difference': total_moving}])
+        csv_outpath = work_dir / f'{g.plate}_{well_site}_w{wavelength + 1}.csv'
+        df.to_csv(csv_outpath, index=False)
+
+    return wavelengths
+
+
+# Automatic noise thresholds per (plate, wavelength), estimated once for the whole plate by estimate_diff_thresholds()
+DIFF_THRESHOLDS = {}
+
+
+# Estimates the automatic noise threshold of each selected wavelength once for the whole plate and stores it in
+# DIFF_THRESHOLDS, so every well_site is thresholded at the same level. Does nothing if diff_threshold is fixed.
+# Called in wrapper.py before the well_site loop
+def estimate_diff_thresholds(g, options, well_sites):
+    if options.get('diff_threshold', 'auto') != 'auto' or g.time_points < 2:
+        return
+    for wavelength in get_frame_difference_wavelengths(g, options):
+        threshold = estimate_diff_threshold(g, options, well_sites, wavelength)
+        DIFF_THRESHOLDS[(g.plate, wavelength)] = threshold
+        print(f"Frame difference threshold for w{wavelength + 1}: {threshold:.1f}")
+
+
+######################################################
+######### FRAME DIFFERENCE HELPER FUNCTIONS  #########
+######################################################
+
+# Returns the 0-indexed wavelengths selected in the options ('All' or a list like ['w1', 'w2'])
+# Called in frame_difference() and estimate_diff_thresholds()
+def get_frame_difference_wavelengths(g, options):
+    wavelengths_option = ','.join(options['wavelengths'])
+    if wavelengths_option == 'All':
+        return [i for i in range(g.n_waves)]  # Use all available wavelengths
+    return [int(w[1:]) - 1 for w in wavelengths_option.split(',')]
+
+
+# Estimates one noise threshold for a wavelength from the first frame pair of the given well_sites.
+# Uses the noise model of the motion-adaptive modes (preprocessing/motion.py): NOISE_MULTIPLIER times the median
+# absolute difference, over the pixels inside the region of interest that are not zero in both frames.
+# The differences of all well_sites are pooled, so a few wells with moving worms do not raise the threshold.
+# Called in frame_difference() and estimate_diff_thresholds()
+def estimate_diff_threshold(g, options, well_sites, wavelength):
+    roi = options.get('roi', 'none')
+    samples = []
+    for well_site in well_sites:
+        frame_paths = [Path(g.plate_dir) / f'TimePoint_{timepoint}' / f'{g.plate_short}_{well_site}_w{wavelength + 1}.TIF' for timepoint in (1, 2)]
+        frame1, frame2 = [cv2.imread(str(frame_path), cv2.IMREAD_ANYDEPTH) for frame_path in frame_paths]
+        if frame1 is None or frame2 is None:
+            continue
+        (y0, y1, x0, x1), roi_mask = get_flow_roi(g, frame1, roi)
+        values = pair_differences(frame1[y0:y1, x0:x1], frame2[y0:y1, x0:x1], roi_mask)
+        # A regular subsample of each well is enough to estimate the noise level
+        samples.append(values[::16])
+    return noise_level(np.concatenate(samples) if samples else [])
@@ -1,10 +1,14 @@
-from matplotlib import cm
+from concurrent.futures import ThreadPoolExecutor
 import cv2
+import os
 from pathlib import Path
-from PIL import Image
 import numpy as np
 import pandas as pd
-from scipy import ndimage
+
+from preprocessing.heatmap import save_motility_heatmap
+from preprocessing.motion import frame_difference_score
+from preprocessing.roi import get_flow_roi
+from preprocessing.tiling import tile_starts
 
 ###############################################
 ######### OPTICAL FLOW MAIN FUNCTION  #########
@@ -28,67 +32,84 @@ def optical_flow(g, options, well_site, multiplier=2):
     else:
         wavelengths = [int(w[1:]) - 1 for w in wavelengths_option.split(',')]
 
+    # Large frames (e.g., whole-plate AVIs) can be split into overlapping tiles that are processed on a thread pool
+    tile_size = options.get('tile_size', 0) or 0
+    tile_overlap = min(options.get('tile_overlap', 64), tile_size // 2)
+    tile_workers = options.get('tile_workers', 'auto')
+    executor = None
+    if tile_size > 0:
+        executor = ThreadPoolExecutor(max_workers=os.cpu_count() if tile_workers == 'auto' else int(tile_workers))
+
+    # Region of interest: 'none' (whole frame), 'mask' (configured circle_diameter/square_side) or 'auto' (detected well)
+    roi = options.get('roi', 'none')
+
+    # Motion-adaptive mode: skip flow for static frame pairs and compute the remaining pairs at a stride
+    adaptive = options.get('adaptive', False)
+    motion_threshold = options.get('motion_threshold', 0.05)
+    pair_stride = max(1, int(options.get('pair_stride', 1)))
+
     total_mag = 0  # Initialize total_mag for the current well_site
 
     # Loop through all wavelengths
     for wavelength in wavelengths:
         all_results = []  # List to store results for the current wavelength
 
-        # Create empty list to store magnitude arrays for the current well_site
-        all_mag = []
-
         # Read first frame
         frame1_path = Path(g.plate_dir) / f'TimePoint_1' / f'{g.plate_short}_{well_site}_w{wavelength + 1}.TIF'
         frame1 = cv2.imread(str(frame1_path), cv2.IMREAD_ANYDEPTH).astype('uint16')
+        height, width = frame1.shape
+
+        # Restrict flow to the well region of interest (bounding box + mask) if requested
+        (y0, y1, x0, x1), roi_mask = get_flow_roi(g, frame1, roi)
+        frame1 = frame1[y0:y1, x0:x1]
+
+        # Running sum of the magnitude arrays for the current well_site
+        roi_sum = np.zeros(frame1.shape, dtype=np.float32)
+        magnitude = None
+        computed_pairs, estimated_pairs, skipped_pairs = 0, 0, 0
 
         # Loop through all timepoints
         for timepoint in range(g.time_points - 1):
             # Get path of frame 1 and frame 2
             frame2_path = Path(g.plate_dir) / f'TimePoint_{timepoint + 2}' / f'{g.plate_short}_{well_site}_w{wavelength + 1}.TIF'
-            frame2 = cv2.imread(str(frame2_path), cv2.IMREAD_ANYDEPTH).astype('uint16')
-
-            # Calculate optical flow
-            flow = cv2.calcOpticalFlowFarneback(frame1, frame2, options['flow'], options['pyrScale'], options['levels'], options['winsize'], options['iterations'], options['poly_n'], options['poly_sigma'], options['flags'])
-
-            # Calculate magnitude of optical flow vectors
-            magnitude = np.sqrt(flow[..., 0]**2 + flow[..., 1]**2)
+            frame2 = cv2.imread(str(frame2_path), cv2.IMREAD_ANYDEPTH).astype('uint16')[y0:y1, x0:x1]
+
+            if adaptive and frame_difference_score(frame1, frame2, roi_mask) < motion_threshold:
+                # Nothing moved between the frames: record zero flow without running Farneback
+                skipped_pairs += 1
+                frame1 = frame2
+                continue
+
+            if adaptive and magnitude is not None and (computed_pairs + estimated_pairs) % pair_stride != 0:
+                # Between strides, the last computed flow is used as the estimate for this pair
+                estimated_pairs += 1
+            else:
+                # Calculate magnitude of optical flow vectors (whole frame or tiled)
+                magnitude = calc_flow_magnitude(frame1, frame2, options, executor, tile_size, tile_overlap)
+
+                # Only accumulate flow inside the well
+                if roi_mask is not None:
+                    magnitude[~roi_mask] = 0
+                computed_pairs += 1
 
             # Add sum of magnitude values to total_mag
             total_mag += np.sum(magnitude)
 
-            # Store magnitude array in all_mag for the current well_site
-            all_mag.append(magnitude)
+            # Add magnitude array to the running sum for the current well_site
+            roi_sum += magnitude
 
             frame1 = frame2
 
-        # Calculate total flow across the entire array
-        sum_img = np.sum(all_mag, axis=0)
-
-        # Rescaling if required
-        sum_img = sum_img * multiplier
-        pixel_max = np.amax(sum_img)
-
-        # If there is not a single saturated pixel (low flow), set one to 255 in order to prevent rescaling
-        if pixel_max < 255:
-            print(f"Max flow is {pixel_max}. Rescaling")
-            sum_img[0, 0] = 255
-        # If there are saturated pixels (high flow), adjust everything > 255 to prevent rescaling
-        elif pixel_max > 255:
-            print(f"Max flow is {pixel_max}. Rescaling")
-            sum_img[sum_img > 255] = 255
-        else:
-            print("Something went wrong.")
-
-        # Apply Gaussian filter
-        sum_blur = ndimage.filters.gaussian_filter(sum_img, 1.5)
+        if adaptive:
+            print(f"Adaptive flow: computed {computed_pairs}, estimated {estimated_pairs}, skipped {skipped_pairs} of {g.time_points - 1} frame pairs.")
 
-        # Apply PIL colourmap
-        new_im = np.asarray(sum_blur) / 255
-        sum_blur_colour = Image.fromarray(np.uint8(cm.inferno(new_im) * 255))
+        # Place the total flow back into a full-size image
+        sum_img = np.zeros((height, width), dtype=np.float32)
+        sum_img[y0:y1, x0:x1] = roi_sum
 
         # Save flow image in 'work/optical_flow' folder
         outpath = work_dir / f'{g.plate}_{well_site}_w{wavelength + 1}.png'
-        sum_blur_colour.save(outpath)
+        save_motility_heatmap(sum_img, outpath, multiplier)
 
         # Prepare results for the current well_site and wavelength
         result = {
@@ -104,4 +125,60 @@ def optical_flow(g, options, well_site, multiplier=2):
         csv_outpath = work_dir / f'{g.plate}_{well_site}_w{wavelength + 1}.csv'
         df.to_csv(csv_outpath, index=False)
 
+    if executor is not None:
+        executor.shutdown()
+
     return wavelengths
+
+
+##################################################
+######### OPTICAL FLOW HELPER FUNCTIONS  #########
+##################################################
+
+# Calculates the magnitude of the dense optical flow between two frames.
+# If a thread pool is given and the frames are larger than tile_size, flow is computed on overlapping tiles in parallel
+# and the tile magnitudes are blended back together with linear weights across the overlaps.
+# Called in optical_flow()
+def calc_flow_magnitude(frame1, frame2, options, executor=None, tile_size=0, tile_overlap=0):
+    height, width = frame1.shape
+    if executor is None or tile_size <= 0 or (height <= tile_size and width <= tile_size):
+        return farneback_magnitude(frame1, frame2, options)
+
+    tiles = [(y, x) for y in tile_starts(height, tile_size, tile_overlap) for x in tile_starts(width, tile_size, tile_overlap)]
+    futures = [
+        executor.submit(farneback_magnitude, frame1[y:y + tile_size, x:x + tile_size], frame2[y:y + tile_size, x:x + tile_size], options)
+        for y, x in tiles
+    ]
+
+    # Accumulate weighted tile magnitudes and normalise by the summed weights
+    magnitude = np.zeros((height, width), dtype=np.float32)
+    weights = np.zeros((height, width), dtype=np.float32)
+    for (y, x), future in zip(tiles, futures):
+        tile_mag = future.result()
+        tile_h, tile_w = tile_mag.shape
+        weight = np.outer(blend_ramp(y, tile_h, height, tile_overlap), blend_ramp(x, tile_w, width, tile_overlap))
+        magnitude[y:y + tile_h, x:x + tile_w] += tile_mag * weight
+        weights[y:y + tile_h, x:x + tile_w] += weight
+
+    return magnitude / weights
+
+
+# Runs Farneback optical flow on a pair of frames (or tiles) and returns the per-pixel flow magnitude.
+# Called in calc_flow_magnitude()
+def farneback_magnitude(frame1, frame2, options):
+    flow = cv2.calcOpticalFlowFarneback(frame1, frame2, options['flow'], options['pyrScale'], options['levels'], options['winsize'], options['iterations'], options['poly_n'], options['poly_sigma'], options['flags'])
+    return np.sqrt(flow[..., 0]**2 + flow[..., 1]**2)
+
+
+# Returns 1D blending weights for a tile: 1 in the interior, ramping linearly down across the overlap on any
+# side that borders another tile. Image borders are not ramped.
+# Called in calc_flow_magnitude()
+def blend_ramp(start, length, total, tile_overlap):
+    ramp = np.ones(length, dtype=np.float32)
+    if tile_overlap > 0:
+        edge = np.arange(1, tile_overlap + 1, dtype=np.float32) / (tile_overlap + 1)
+        if start > 0:
+            ramp[:tile_overlap] = edge
+        if start + length < total:
+            ramp[-tile_overlap:] = np.minimum(ramp[-tile_overlap:], edge[::-1])
+    return ramp
@@ -1,10 +1,5 @@
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import os
-import shutil
-import glob
-import subprocess
-import shlex
-import tempfile
 from pathlib import Path
 import numpy as np
 import pandas as pd
@@ -16,14 +11,18 @@ from ultralytics import YOLO
 from config import get_program_dir
 PROGRAM_DIR = get_program_dir()
 
-# Import static_dx for stitching prediction images
-from pipelines.diagnostics import static_dx
+from pipelines.cellpose_engine import cellpose_cache_dir, segment_cellpose, segment_cellpose_plate
+from preprocessing.masks import get_mask
+from preprocessing.tiling import tile_starts
+from preprocessing.utilities import get_timepoints, timepoint_suffix
 
 ###############################################
 ######### SEGMENTATION MAIN FUNCTION  #########
 ###############################################
 
 # Main segmentation function that performs image segmentation using either a Python-based method, Cellpose, or yolo.
+# The selected timepoints (TimePoint_1 by default) are segmented one after another with the same loaded model, and the
+# results of all timepoints are saved to a single CSV per well_site and wavelength.
 def segmentation(g, options, well_site):
     # Create work and output directories and gather the segmentation method
     work_dir = Path(g.work) / 'segmentation'
@@ -34,7 +33,7 @@ def segmentation(g, options, well_site):
     model_type = options['model_type']
     model_sigma = options['model_sigma']
     wavelengths_option = options['wavelengths']
-    timepoints = range(1, 2)  # Process only TimePoint_1
+    timepoints = get_timepoints(g, options.get('timepoints', 1))
 
     # Determine which wavelengths to use
     wavelengths_option = ','.join(wavelengths_option)
@@ -52,183 +51,253 @@ def segmentation(g, options, well_site):
                 print(f"No TIF file found for well site {well_site} for timepoint {timepoint}. Skipping to next timepoint.")
                 continue 
 
-            if model_type == 'python': # Runs if model_type is Python
-                out_dict = defaultdict(list)
-                cols = []
+            # Name of the mask and prediction images of this timepoint (TimePoint_1 keeps the plain name)
+            name = f"{g.plate}_{well_site}_w{wavelength + 1}{timepoint_suffix(timepoint)}"
 
+            if model_type == 'python': # Runs if model_type is Python
                 image = cv2.imread(str(tiff_file), cv2.IMREAD_ANYDEPTH)
 
                 height, width = image.shape
                 mask = create_circular_mask(height, width, radius=height / 2.2)
 
-                # gaussian blur
-                blur = ndimage.filters.gaussian_filter(image, model_sigma)
-
-                # edges
-                sobel = filters.sobel(blur)
-
-                # set threshold, make binary, fill holes
-                threshold = filters.threshold_otsu(sobel)
-                binary = sobel > threshold
+                # gaussian blur, edges and threshold ('skimage' or the faster 'opencv' backend)
+                binary = python_edge_binary(image, model_sigma, options.get('python_backend', 'skimage'))
                 binary = binary * mask
 
                 # Run segmentation based on model selection (segment_sma or segment_mf)
-                segmented_area  = segment_sma(g, well_site, binary) if options['model'] == 'segment_sma' else segment_mf(binary)
+                segmented_area  = segment_sma(g, well_site, binary, timepoint) if options['model'] == 'segment_sma' else segment_mf(binary)
 
-                bin_png = g.work.joinpath(work_dir, f"{g.plate}_{well_site}_w{wavelength+1}.png")
+                bin_png = work_dir / f"{name}.png"
                 cv2.imwrite(str(bin_png), binary * 255)
                     
                 print(f"Segmented area is {segmented_area}")
 
-                # Save segmentation results to CSV
-                if 'segmented_area' not in cols:
-                    cols.append('segmented_area')
-                        
-                out_dict[well_site].append(segmented_area)
-                df = pd.DataFrame.from_dict(out_dict, orient='index', columns=cols)
-                outpath = work_dir.joinpath(f"{g.plate}_{well_site}_w{wavelength+1}.csv")
-                df.to_csv(path_or_buf=outpath, index_label='well_site')
+                results = pd.DataFrame({'well_site': [well_site], 'segmented_area': [segmented_area]})
             
             elif model_type == 'yolo': # Runs if model_type is YOLO
-                model_path = PROGRAM_DIR / "pipelines" / "models" / "yolo" / options['model']
-                
-                # YOLO requires PNG format for processing
-                # Use a temporary directory that is automatically cleaned up after use
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    
-                    # Convert TIF to PNG for YOLO processing
-                    png_path = convert_tif_to_png_for_yolo(tiff_file, temp_dir)
-                    
-                    # Run YOLO segmentation
-                    output_img_dir = output_dir / 'img'
-                    masks_data = run_yolo_segmentation(
-                        model_path,
-                        png_path,
-                        output_img_dir,
-                        g.plate,
-                        well_site,
-                        wavelength + 1
-                    )
-                    
-                    # Create combined labeled mask image (matching cellpose format)
-                    if masks_data:
-                        # Get image shape from first mask
-                        image_shape = masks_data[0]['mask'].shape
-                        labeled_image = create_labeled_mask_from_yolo(masks_data, image_shape)
-                        
-                        # Scale labeled image for visibility (multiply by 255 so objects are visible)
-                        labeled_image_scaled = labeled_image * 255
-                        
-                        # Save labeled mask PNG to work directory
-                        mask_filename = f"{g.plate}_{well_site}_w{wavelength + 1}.png"
-                        mask_path = work_dir / mask_filename
-                        cv2.imwrite(str(mask_path), labeled_image_scaled.astype(np.uint16))
-                        
-                        # Process segmentation metrics
-                        for mask_info in masks_data:
-                            result = {
-                                'well_site': well_site,
-                                'object_number': mask_info['mask_id'],
-                                'size': mask_info['area'],
-                                'compactness': mask_info['compactness'],
-                                'width_px': mask_info['width'],
-                                'length_px': mask_info['length'],
-                                'confidence': mask_info['confidence'],
-                                'class_id': mask_info['class_id'],
-                                'class_name': mask_info['class_name']
-                            }
-                            all_results.append(result)
-                    else:
-                        # No masks detected
-                        result = {
-                            'well_site': well_site,
-                            'object_number': "NA",
-                            'size': "NA",
-                            'compactness': "NA",
-                            'width_px': "NA",
-                            'length_px': "NA",
-                            'confidence': "NA",
-                            'class_id': "NA",
-                            'class_name': "NA"
-                        }
-                        all_results.append(result)
+                model_path = yolo_model_path(options)
                 
-                # Save results to CSV
-                df = pd.DataFrame(all_results)
-                csv_outpath = work_dir / f'{g.plate}_{well_site}_w{wavelength + 1}.csv'
-                df.to_csv(csv_outpath, index=False)
-
-                # Check if all wells have been processed and stitch prediction images
-                stitch_yolo_predictions(g, wavelength, output_dir)
+                # Rescale the TIF to 8-bit in memory and pass the array straight to YOLO
+                image = rescale_tif_for_yolo(tiff_file)
+
+                # Run YOLO segmentation (prediction images are only written if save_predictions is set)
+                output_img_dir = output_dir / 'img'
+                labeled_image, objects = run_yolo_segmentation(
+                    model_path,
+                    image,
+                    output_img_dir,
+                    name,
+                    cache_size=options.get('yolo_cache_size', 2),
+                    save_predictions=options.get('save_predictions', True),
+                    options=options
+                )
+
+                # Save the labelled mask and collect the segmentation metrics of this timepoint
+                results = write_yolo_outputs(work_dir, name, well_site, labeled_image, objects)
 
             else: # Runs if model_type is Cellpose
                 model_path = PROGRAM_DIR / "pipelines" / "models" / "cellpose" / options['model']
                 
-                # CellPose requires images to be in a directory for processing.
-                # A temporary directory is chosen as it is automatically cleaned up after use
-                with tempfile.TemporaryDirectory() as temp_dir:
-
-                    # Rename the TIF file to .tif as Cellpose also requires images to be in .tif format.
-                    rename_file_to_tif(tiff_file, temp_dir)
-
-                    # Run CellPose to segment the images for the current timepoint and wavelength
-                    run_cellpose(model_type, model_path, temp_dir)
-
-                    # Rename and move the resulting PNG mask to the 'work/cellprofiler' directory
-                    for file in glob.glob(f"{temp_dir}/*.png"):
-                        if 'cp_masks' in file:
-                            new_filename = f"{g.plate}_{well_site}_w{wavelength + 1}.png"
-                            shutil.copy(file, work_dir / new_filename)
+                # Run CellPose to segment the image and save the PNG mask to the 'work/segmentation' directory
+                # (in 'plate' mode the masks of all well_sites were already made by segmentation_cellpose_plate())
+                cellpose_mode = options.get('cellpose_mode', 'subprocess')
+                if cellpose_mode != 'plate':
+                    segment_cellpose(model_path, tiff_file, work_dir / f"{name}.png", cellpose_mode, cellpose_cache_dir(g, options))
 
                 # Process segmentation metrics
-                image_path = work_dir / f'{g.plate}_{well_site}_w{wavelength + 1}.png'
+                image_path = work_dir / f'{name}.png'
                 if os.path.exists(image_path):
-                    image = io.imread(image_path)
-                    labeled_image = measure.label(image)
-                    for object_id, region in enumerate(measure.regionprops(labeled_image), start=1):
-                        result = {
-                            'well_site': well_site,
-                            'object_number': object_id,
-                            'size': region.area,
-                            'compactness': (region.perimeter ** 2) / (4 * np.pi * region.area) if region.area > 0 else 0
-                        }
-                        all_results.append(result)
+                    results = measure_cellpose_objects(io.imread(image_path), well_site)
                 else:
-                    result = {
+                    results = pd.DataFrame([{
                         'well_site': well_site,
                         'object_number': "NA",
                         'size': "NA",
                         'compactness': "NA"
-                    }
-                    all_results.append(result)
+                    }])
 
-                # Save results to CSV
-                df = pd.DataFrame(all_results)
-                csv_outpath = work_dir / f'{g.plate}_{well_site}_w{wavelength + 1}.csv'
-                df.to_csv(csv_outpath, index=False)
+            all_results.append((timepoint, results))
+
+        # Save the results of all timepoints to CSV
+        if all_results:
+            write_segmentation_csv(g, work_dir, well_site, wavelength, all_results, timepoints)
 
     return wavelengths
 
 
+# Plate-level YOLO segmentation (yolo_mode: 'plate'). Collects the images of every well_site at the selected timepoints
+# and runs predictions in batches of yolo_batch_size, then writes the same per-well CSVs, labelled masks and prediction
+# images (if save_predictions is set) as segmentation().
+# Called in wrapper.py after the well_site loop
+def segmentation_yolo_plate(g, options, well_sites):
+    work_dir = Path(g.work) / 'segmentation'
+    output_dir = Path(g.output) / 'segmentation'
+    output_img_dir = output_dir / 'img'
+    work_dir.mkdir(parents=True, exist_ok=True)
+    output_img_dir.mkdir(parents=True, exist_ok=True)
+
+    # Determine which wavelengths and timepoints to use
+    wavelengths_option = ','.join(options['wavelengths'])
+    wavelengths = [int(w[1:]) - 1 for w in wavelengths_option.split(',')] if wavelengths_option != 'All' else list(range(g.n_waves))
+    timepoints = get_timepoints(g, options.get('timepoints', 1))
+
+    model_path = yolo_model_path(options)
+    model = get_yolo_model(model_path, options.get('yolo_cache_size', 2))
+    batch_size = max(1, int(options.get('yolo_batch_size', 8)))
+    save_predictions = options.get('save_predictions', True)
+    tile_size = int(options.get('yolo_tile_size', 0))
+
+    for wavelength in wavelengths:
+        # Gather the image of each well_site and timepoint (it may or may not have wavelength suffix)
+        batch_inputs = []
+        for well_site in well_sites:
+            for timepoint in timepoints:
+                tiff_file_base = os.path.join(g.input, g.plate, f"TimePoint_{timepoint}", f"{g.plate_short}_{well_site}")
+                tiff_file = next((f for f in (f"{tiff_file_base}_w{wavelength + 1}.TIF", f"{tiff_file_base}.TIF") if os.path.exists(f)), None)
+                if tiff_file is None:
+                    print(f"No TIF file found for well site {well_site} for timepoint {timepoint}. Skipping.")
+                    continue
+                batch_inputs.append((well_site, timepoint, tiff_file))
+
+        # Metrics of each well_site, collected over its timepoints and saved to one CSV at the end
+        all_results = defaultdict(list)
+
+        # Run predictions one batch at a time so that only one batch of images is held in memory
+        for batch_start in range(0, len(batch_inputs), batch_size):
+            batch = batch_inputs[batch_start:batch_start + batch_size]
+            print(f"Running YOLO on well sites {batch[0][0]} to {batch[-1][0]} (wavelength {wavelength + 1}).")
+
+            images = [rescale_tif_for_yolo(tiff_file) for _, _, tiff_file in batch]
+            # Mask and prediction images are named as in the well-level mode
+            names = [f"{g.plate}_{well_site}_w{wavelength + 1}{timepoint_suffix(timepoint)}" for well_site, timepoint, _ in batch]
+
+            # Images larger than yolo_tile_size are predicted tile by tile (the tiles of each image are batched
+            # instead), as in run_yolo_segmentation(); the remaining images are predicted as one batch
+            whole = []
+            for item, name, image in zip(batch, names, images):
+                if tile_size > 0 and max(image.shape[:2]) > tile_size:
+                    well_site, timepoint, _ = item
+                    outpath = output_img_dir / f"{name}.png" if save_predictions else None
+                    labeled_image, objects = run_yolo_tiled(model, image, options, outpath)
+                    all_results[well_site].append((timepoint, write_yolo_outputs(work_dir, name, well_site, labeled_image, objects)))
+                else:
+                    whole.append((item, name, image))
+            if not whole:
+                continue
+
+            # retina_masks is passed on every predict call: the cached model keeps it from earlier (tiled) calls
+            results = model.predict(source=[image for _, _, image in whole], batch=len(whole), retina_masks=False, verbose=False)
+
+            for ((well_site, timepoint, _), name, _), result in zip(whole, results):
+                if save_predictions:
+                    result.save(filename=str(output_img_dir / f"{name}.png"))
+
+                labeled_image, objects = yolo_masks_from_result(result, model)
+                all_results[well_site].append((timepoint, write_yolo_outputs(work_dir, name, well_site, labeled_image, objects)))
+
+        for well_site, results in all_results.items():
+            write_segmentation_csv(g, work_dir, well_site, wavelength, results, timepoints)
+
+    return wavelengths
+
+
+# Plate-level Cellpose segmentation (cellpose_mode: 'plate'). Runs Cellpose over the images of all well_sites and
+# selected wavelengths (once per selected timepoint, as the images of different timepoints share their file names)
+# and saves each mask under its per-well name in 'work/segmentation'.
+# segmentation() then only measures the masks of each well_site.
+# Called in wrapper.py before the well_site loop
+def segmentation_cellpose_plate(g, options, well_sites):
+    work_dir = Path(g.work) / 'segmentation'
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    # Determine which wavelengths and timepoints to use
+    wavelengths_option = ','.join(options['wavelengths'])
+    wavelengths = [int(w[1:]) - 1 for w in wavelengths_option.split(',')] if wavelengths_option != 'All' else list(range(g.n_waves))
+    timepoints = get_timepoints(g, options.get('timepoints', 1))
+
+    model_path = PROGRAM_DIR / "pipelines" / "models" / "cellpose" / options['model']
+    for timepoint in timepoints:
+        tiff_outpaths = {}
+        for wavelength in wavelengths:
+            for well_site in well_sites:
+                tiff_file_base = os.path.join(g.input, g.plate, f"TimePoint_{timepoint}", f"{g.plate_short}_{well_site}")
+                tiff_file = next((f for f in (f"{tiff_file_base}_w{wavelength + 1}.TIF", f"{tiff_file_base}.TIF") if os.path.exists(f)), None)
+                if tiff_file is not None:
+                    tiff_outpaths.setdefault(tiff_file, []).append(work_dir / f"{g.plate}_{well_site}_w{wavelength + 1}{timepoint_suffix(timepoint)}.png")
+
+        segment_cellpose_plate(model_path, tiff_outpaths, work_dir, cellpose_cache_dir(g, options))
+    return wavelengths
+
 ##################################################
 ######### SEGMENTATION HELPER FUNCTIONS  #########
 ##################################################
 
 # Create a circular mask for an image of height h and width w. Useful for restricting analysis to a circular region.
+# The mask comes from the shared mask cache, so it is read-only.
 def create_circular_mask(h, w, center=None, radius=None):
     if center is None:
         center = (int(w / 2), int(h / 2))
     if radius is None:
         radius = min(center[0], center[1], w - center[0], h - center[1])
 
-    Y, X = np.ogrid[:h, :w]
-    dist_from_center = np.sqrt((X - center[0])**2 + (Y - center[1])**2)
-    mask = dist_from_center <= radius
-    return mask
+    return get_mask((h, w), center, radius, 'circle')
+
+
+# Blurs an image, detects edges with a Sobel filter and thresholds the edge magnitude with Otsu's method.
+# Returns the binary edge image used by the python model. backend selects the implementation:
+# 'skimage' (scipy gaussian_filter, skimage sobel and threshold_otsu on float64) or 'opencv' (the same steps with OpenCV
+# on float32 buffers, several times faster). The two backends agree to within rounding; compare them on your own images
+# with supplemental/scripts/benchmarks/python_backend_comparison.py.
+# Called in segmentation()
+def python_edge_binary(image, sigma, backend='skimage'):
+    if backend == 'skimage':
+        blur = ndimage.filters.gaussian_filter(image, sigma)
+        sobel = filters.sobel(blur)
+        threshold = filters.threshold_otsu(sobel)
+    elif backend == 'opencv':
+        sobel = sobel_opencv(gaussian_filter_opencv(image, sigma))
+        threshold = threshold_otsu_opencv(sobel)
+    else:
+        raise ValueError(f"Unsupported python_backend: {backend}. Use 'skimage' or 'opencv'.")
+    return sobel > threshold
+
+
+# OpenCV Gaussian blur matching ndimage.gaussian_filter: kernel radius int(4 * sigma + 0.5) (truncate=4.0), mirrored
+# borders, and the output keeps the dtype of the input.
+# Called in python_edge_binary()
+def gaussian_filter_opencv(image, sigma):
+    ksize = 2 * int(4 * sigma + 0.5) + 1
+    return cv2.GaussianBlur(image, (ksize, ksize), sigma, sigmaY=sigma, borderType=cv2.BORDER_REFLECT)
+
+
+# OpenCV Sobel magnitude matching skimage.filters.sobel: integer images are scaled to [0, 1] first, each kernel is
+# normalised by 1/4 and the magnitude is sqrt((gx**2 + gy**2) / 2). Computed in float32.
+# Called in python_edge_binary()
+def sobel_opencv(image):
+    scale = 0.25 / np.iinfo(image.dtype).max if np.issubdtype(image.dtype, np.integer) else 0.25
+    image = image.astype(np.float32)
+    gx = cv2.Sobel(image, cv2.CV_32F, 1, 0, ksize=3, scale=scale, borderType=cv2.BORDER_REFLECT)
+    gy = cv2.Sobel(image, cv2.CV_32F, 0, 1, ksize=3, scale=scale, borderType=cv2.BORDER_REFLECT)
+    return cv2.magnitude(gx, gy) * np.float32(np.sqrt(0.5))
+
+
+# Otsu threshold of a float image with OpenCV. OpenCV's Otsu works on 8-bit images, so the image is scaled to 256
+# levels over its own range (as threshold_otsu bins it into 256 bins) and the 8-bit threshold is mapped back.
+# Called in python_edge_binary()
+def threshold_otsu_opencv(image):
+    low, high = float(image.min()), float(image.max())
+    if high == low:
+        return low
+    alpha = 255 / (high - low)
+    scaled = cv2.convertScaleAbs(image, alpha=alpha, beta=-low * alpha)
+    threshold, _ = cv2.threshold(scaled, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Map the 8-bit level back to the boundary between it and the next level in the original units
+    return low + (threshold + 0.5) / alpha
 
 
 # Originally developed to segment S. mansoni from a binary image, remove small debris, and save intermediate images.
-def segment_sma(g, well_site, binary):
+# The intermediate images are named per timepoint like the masks (TimePoint_1 keeps the plain name).
+def segment_sma(g, well_site, binary, timepoint=1):
     filled = ndimage.binary_fill_holes(binary)
 
     # Remove small segmented debris
@@ -239,21 +308,18 @@ def segment_sma(g, well_site, binary):
 
     # empirically derived minimum size
     min_size, max_size = 10, 500
-    bad_indices = []
-    filtered = np.zeros(labelled_image.shape, dtype=np.uint8)
+    keep = (sizes >= min_size) & (sizes <= max_size)
 
-    for i in range(nb_components):
-        if min_size <= sizes[i] <= max_size:
-            filtered[labelled_image == i + 1] = 255
-        else:
-            bad_indices.append(i)
+    # Map every label to 255 (kept) or 0 (background or dropped) in a single lookup over the label image
+    lut = np.zeros(nb_components + 1, dtype=np.uint8)
+    lut[1:][keep] = 255
+    filtered = lut[labelled_image]
 
-    sizes_l = list(sizes)
-    filtered_sizes = [j for i, j in enumerate(sizes_l) if i not in bad_indices]
+    filtered_sizes = list(sizes[keep])
 
     # Saving the filled and filtered images with proper scaling
-    cv2.imwrite(str(Path(g.work) / "segmentation" / f"{g.plate}_{well_site}_filled.png"), filled.astype(np.uint8) * 255)
-    cv2.imwrite(str(Path(g.work) / "segmentation" / f"{g.plate}_{well_site}_filtered.png"), filtered.astype(np.uint8) * 255)
+    cv2.imwrite(str(Path(g.work) / "segmentation" / f"{g.plate}_{well_site}_filled{timepoint_suffix(timepoint)}.png"), filled.astype(np.uint8) * 255)
+    cv2.imwrite(str(Path(g.work) / "segmentation" / f"{g.plate}_{well_site}_filtered{timepoint_suffix(timepoint)}.png"), filtered.astype(np.uint8) * 255)
 
     return filtered_sizes
 
@@ -265,29 +331,10 @@ def segment_mf(binary):
     return area
 
 
-# This function renames a .TIF file as .tif.  
-# This is necessary because CellPose requires images to be in a directory and in .tif format for processing.
-def rename_file_to_tif(src_file, temp_dir):
-    temp_file = Path(temp_dir) / (Path(src_file).stem + '.tif')
-    shutil.copy(src_file, temp_file)
-    return temp_file
-
-
-# This function runs the CellPose segmentation model on .tif images in a given directory.
-def run_cellpose(model_type, model_path, temp_dir):
-    cellpose_command = (
-        f'python -m {model_type} '
-        f'--dir {temp_dir} '
-        f'--pretrained_model {model_path} '
-        f'--diameter 0 --save_png --no_npy --verbose'
-    )
-    cellpose_command_split = shlex.split(cellpose_command)
-    subprocess.run(cellpose_command_split)
-
-
-# Convert a TIF file to PNG format for YOLO processing and returns the path to the PNGs.
-# Called in segmentation after temp directory is made
-def convert_tif_to_png_for_yolo(tif_path, temp_dir, p_low=2.0, p_high=98.0):
+# Reads a TIF file and rescales it to an 8-bit, 3-channel array between the p_low and p_high percentiles for YOLO.
+# The array is identical to the image YOLO used to read back from a temporary PNG, without the encode/decode round trip.
+# Called in segmentation() and segmentation_yolo_plate()
+def rescale_tif_for_yolo(tif_path, p_low=2.0, p_high=98.0):
 
     # Read the TIF file
     img = cv2.imread(str(tif_path), cv2.IMREAD_ANYDEPTH)
@@ -295,33 +342,268 @@ def convert_tif_to_png_for_yolo(tif_path, temp_dir, p_low=2.0, p_high=98.0):
     if img is None:
         raise ValueError(f"Failed to read TIF file: {tif_path}")
     
-    # Convert to float for processing
-    array = img.astype(np.float64)
-    
     # Calculate percentile-based min/max for robust contrast
-    lo = float(np.percentile(array, p_low))
-    hi = float(np.percentile(array, p_high))
+    lo = float(np.percentile(img, p_low))
+    hi = float(np.percentile(img, p_high))
     
     # Rescale to 0-255 range
     if hi > lo:
-        scaled = (array - lo) / (hi - lo)
-        scaled = np.clip(scaled, 0.0, 1.0)
+        scaled = (img - lo) / (hi - lo)
+        np.clip(scaled, 0.0, 1.0, out=scaled)
         img_uint8 = (scaled * 255.0 + 0.5).astype(np.uint8)
     else:
-        img_uint8 = np.zeros_like(array, dtype=np.uint8)
+        img_uint8 = np.zeros(img.shape, dtype=np.uint8)
     
-    # Save as PNG
-    png_path = Path(temp_dir) / (Path(tif_path).stem + '.png')
-    cv2.imwrite(str(png_path), img_uint8)
-    
-    return png_path
+    # YOLO expects BGR images, as cv2.imread returned them from the PNG
+    return cv2.cvtColor(img_uint8, cv2.COLOR_GRAY2BGR)
+
+
+# Loaded YOLO models kept for the lifetime of the process (each worker process has its own), keyed by model path.
+# The least recently used model is evicted when more than the configured yolo_cache_size models have been loaded.
+YOLO_MODELS = OrderedDict()
+
+
+# Returns the YOLO model for model_path from the cache, loading it on first use.
+# Exported models (ONNX file or OpenVINO folder) are loaded the same way as .pt weights.
+# Called in run_yolo_segmentation(), segmentation_yolo_plate() and warm_yolo_model()
+def get_yolo_model(model_path, cache_size=2):
+    key = str(model_path)
+    if key in YOLO_MODELS:
+        YOLO_MODELS.move_to_end(key)
+        return YOLO_MODELS[key]
+
+    print(f"Loading YOLO model {Path(key).name}.")
+    model = YOLO(key, task='segment')
+    YOLO_MODELS[key] = model
+    while len(YOLO_MODELS) > max(1, int(cache_size)):
+        evicted, _ = YOLO_MODELS.popitem(last=False)
+        print(f"Evicted YOLO model {Path(evicted).name} from the model cache.")
+    return model
+
+
+# Loads and fuses the configured YOLO model once so that no well_site pays the loading cost.
+# Called in wrapper.py before well_sites are processed
+def warm_yolo_model(options):
+    if options.get('model_type') != 'yolo':
+        return
+    model_path = yolo_model_path(options)
+    model = get_yolo_model(model_path, options.get('yolo_cache_size', 2))
+    if Path(model_path).suffix == '.pt':
+        model.fuse()
+
+
+# Returns the path of the YOLO model to load for the configured yolo_runtime.
+# 'pt' uses the weights in pipelines/models/yolo as they are. 'onnx' and 'openvino' use a CPU-optimised copy exported
+# next to the weights, which is created with YOLO.export the first time it is needed and reused afterwards.
+# Called in segmentation(), segmentation_yolo_plate() and warm_yolo_model()
+def yolo_model_path(options):
+    model_path = PROGRAM_DIR / "pipelines" / "models" / "yolo" / options['model']
+    return export_yolo_model(model_path, options.get('yolo_runtime', 'pt'), options.get('yolo_int8', False), options.get('yolo_calibration_data'))
+
+
+# Exports .pt weights to an ONNX file or an OpenVINO folder (optionally int8-quantised) unless the export already exists,
+# and returns its path. Export names follow ultralytics: <model>.onnx, <model>_openvino_model, <model>_int8_openvino_model.
+# int8 quantisation calibrates on calibration_data (a dataset YAML); ultralytics uses its sample dataset if it is not set.
+# Called in yolo_model_path()
+def export_yolo_model(model_path, runtime='pt', int8=False, calibration_data=None):
+    model_path = Path(model_path)
+    if runtime == 'pt' or model_path.suffix != '.pt':
+        return model_path
+
+    if runtime == 'onnx':
+        export_path = model_path.with_suffix('.onnx')
+        export_args = {'format': 'onnx', 'dynamic': True}
+    elif runtime == 'openvino':
+        export_path = model_path.parent / f"{model_path.stem}_{'int8_' if int8 else ''}openvino_model"
+        export_args = {'format': 'openvino', 'dynamic': True, 'int8': bool(int8)}
+        if int8 and calibration_data:
+            export_args['data'] = calibration_data
+    else:
+        raise ValueError(f"Unsupported yolo_runtime: {runtime}. Use 'pt', 'onnx' or 'openvino'.")
+
+    if not export_path.exists():
+        print(f"Exporting YOLO model {model_path.name} to {runtime}{' (int8)' if int8 and runtime == 'openvino' else ''}.")
+        export_path = Path(YOLO(str(model_path)).export(**export_args))
+    return export_path
+
+
+# Run YOLO segmentation model on an image array and process results.
+# The prediction image (boxes and masks drawn on the input) is saved to output_img_dir as '{run_name}.png' only if
+# save_predictions is set.
+# Called in segmentation after the TIF is rescaled
+def run_yolo_segmentation(model_path, image, output_img_dir, run_name, cache_size=2, save_predictions=True, options=None):
+    # Load YOLO model (cached across well_sites)
+    model = get_yolo_model(model_path, cache_size)
+
+    # Images larger than yolo_tile_size are predicted in overlapping tiles
+    tile_size = int(options.get('yolo_tile_size', 0)) if options else 0
+    if tile_size > 0 and max(image.shape[:2]) > tile_size:
+        output_img_dir.mkdir(parents=True, exist_ok=True)
+        outpath = output_img_dir / f"{run_name}.png" if save_predictions else None
+        return run_yolo_tiled(model, image, options, outpath)
+
+    # Run inference (retina_masks is passed explicitly: the cached model keeps it from earlier tiled calls)
+    results = model.predict(source=image, retina_masks=False)
+
+    # Save prediction images with bounding boxes
+    if save_predictions:
+        output_img_dir.mkdir(parents=True, exist_ok=True)
+        for result in results:
+            result.save(filename=str(output_img_dir / f"{run_name}.png"))
+
+    # Process results (a single image gives a single result)
+    return yolo_masks_from_result(results[0], model)
+
+
+# Builds the labelled mask of a single YOLO result and measures every mask.
+# The masks are moved off the device once as a stacked array. Returns (labeled_image, objects), where objects is a
+# DataFrame with one row per mask, or (None, empty DataFrame) if nothing was detected.
+# Called in run_yolo_segmentation() and segmentation_yolo_plate()
+def yolo_masks_from_result(result, model):
+    if not result.masks:
+        return None, pd.DataFrame()
+
+    masks = result.masks.data.cpu().numpy() > 0.5
+    n_objects = len(masks)
+    labeled_image = create_labeled_mask_from_yolo(masks)
+    objects = measure_yolo_objects(crop_masks_to_boxes(masks))
+
+    # Extract confidence scores and class IDs (default to 0.0 and -1 if not available)
+    confidences = np.zeros(n_objects)
+    class_ids = np.full(n_objects, -1, dtype=int)
+    if result.boxes is not None:
+        n_boxes = min(n_objects, len(result.boxes))
+        confidences[:n_boxes] = result.boxes.conf.cpu().numpy()[:n_boxes]
+        class_ids[:n_boxes] = result.boxes.cls.cpu().numpy()[:n_boxes]
+    add_yolo_classes(objects, confidences, class_ids, model)
+
+    return labeled_image, objects
+
+
+# Adds the confidence, class_id and class_name columns of each detection to the objects DataFrame.
+# Called in yolo_masks_from_result() and run_yolo_tiled()
+def add_yolo_classes(objects, confidences, class_ids, model):
+    objects['confidence'] = confidences
+    objects['class_id'] = class_ids
+    objects['class_name'] = [model.names[c] if c >= 0 and c in model.names else "unknown" for c in class_ids]
+    return objects
+
+
+# Runs YOLO on an image too large for the model's input size by splitting it into overlapping tiles of yolo_tile_size,
+# which are predicted in batches of yolo_batch_size with masks at tile resolution. Detections are moved to image
+# coordinates and merged across tile seams with class-agnostic NMS (IoU above yolo_tile_iou). Detections cut by an
+# interior tile edge are ranked below complete ones, so the complete copy of a worm in the overlap is kept.
+# The kept masks are pasted into a single label image and measured (from their box crops) as in yolo_masks_from_result().
+# Called in run_yolo_segmentation() and segmentation_yolo_plate()
+def run_yolo_tiled(model, image, options, outpath=None):
+    height, width = image.shape[:2]
+    tile_size = int(options['yolo_tile_size'])
+    tile_overlap = min(int(options.get('yolo_tile_overlap', 128)), tile_size // 2)
+    batch_size = max(1, int(options.get('yolo_batch_size', 8)))
+    tile_iou = float(options.get('yolo_tile_iou', 0.5))
+
+    tiles = [(y, x) for y in tile_starts(height, tile_size, tile_overlap) for x in tile_starts(width, tile_size, tile_overlap)]
+    print(f"Running YOLO on {len(tiles)} tiles of {tile_size} px.")
+
+    # Gather every detection as an image-space box with its mask cropped to the box
+    boxes, scores, ranks, class_ids, masks = [], [], [], [], []
+    for batch_start in range(0, len(tiles), batch_size):
+        batch = tiles[batch_start:batch_start + batch_size]
+        crops = [image[y:y + tile_size, x:x + tile_size] for y, x in batch]
+        # Tile masks are needed at tile resolution to be placed in the image. The other predict calls on the cached
+        # model pass retina_masks=False, as Ultralytics keeps predictor arguments between calls.
+        results = model.predict(source=crops, batch=len(crops), retina_masks=True, verbose=False)
+
+        for (y, x), crop, result in zip(batch, crops, results):
+            if not result.masks or result.boxes is None:
+                continue
+            tile_h, tile_w = crop.shape[:2]
+            tile_masks = result.masks.data.cpu().numpy() > 0.5
+            xyxy = result.boxes.xyxy.cpu().numpy()
+            conf = result.boxes.conf.cpu().numpy()
+            cls = result.boxes.cls.cpu().numpy().astype(int)
+
+            for i in range(min(len(tile_masks), len(xyxy))):
+                x0, y0 = max(0, int(np.floor(xyxy[i, 0]))), max(0, int(np.floor(xyxy[i, 1])))
+                x1, y1 = min(tile_w, int(np.ceil(xyxy[i, 2]))), min(tile_h, int(np.ceil(xyxy[i, 3])))
+                if x1 <= x0 or y1 <= y0:
+                    continue
+
+                # Cut by a tile edge that is not an image border
+                cut = (x0 == 0 and x > 0) or (y0 == 0 and y > 0) or (x1 == tile_w and x + tile_w < width) or (y1 == tile_h and y + tile_h < height)
+
+                boxes.append([x + x0, y + y0, x1 - x0, y1 - y0])
+                scores.append(float(conf[i]))
+                ranks.append(float(conf[i]) - (1.0 if cut else 0.0))
+                class_ids.append(int(cls[i]))
+                masks.append(tile_masks[i, y0:y1, x0:x1])
+
+    # Merge duplicate detections across tile seams
+    keep = np.array(cv2.dnn.NMSBoxes(boxes, ranks, -1.0, tile_iou), dtype=int).reshape(-1) if boxes else np.array([], dtype=int)
+    keep = np.sort(keep)
+
+    # Paste the kept masks into the label image in detection order (later masks win where they overlap)
+    labeled_image = np.zeros((height, width), dtype=np.uint16)
+    for object_id, i in enumerate(keep, start=1):
+        bx, by, bw, bh = boxes[i]
+        labeled_image[by:by + bh, bx:bx + bw][masks[i]] = object_id
+
+    if outpath is not None:
+        save_tiled_predictions(image, [boxes[i] for i in keep], outpath)
+
+    if not len(keep):
+        return None, pd.DataFrame()
+
+    objects = measure_yolo_objects([masks[i] for i in keep])
+    add_yolo_classes(objects, np.array(scores)[keep], np.array(class_ids)[keep], model)
+    return labeled_image, objects
+
+
+# Draws the merged boxes of a tiled prediction on the image and saves it as the well's prediction image.
+# Called in run_yolo_tiled()
+def save_tiled_predictions(image, boxes, outpath):
+    overlay = image.copy()
+    thickness = max(1, round(max(image.shape[:2]) / 1000))
+    for bx, by, bw, bh in boxes:
+        cv2.rectangle(overlay, (bx, by), (bx + bw - 1, by + bh - 1), (0, 0, 255), thickness)
+    cv2.imwrite(str(outpath), overlay)
+
+
+# Measures each YOLO mask on its own and returns the per-object metrics: the area, rotated-rectangle width and length
+# and compactness (perimeter**2 / (4 * pi * area)) of the mask's largest external contour. Masks are measured before
+# they are combined into the label image, so overlapping worms keep their full size. masks may be full-size or already
+# cut to their boxes; masks without a contour get zeros.
+# Called in yolo_masks_from_result() and run_yolo_tiled()
+def measure_yolo_objects(masks):
+    measurements = np.array([measure_mask_yolo(mask) for mask in masks], dtype=float).reshape(-1, 4)
+
+    return pd.DataFrame({
+        'object_number': np.arange(1, len(measurements) + 1),
+        'size': measurements[:, 0],
+        'compactness': measurements[:, 3],
+        'width_px': measurements[:, 1],
+        'length_px': measurements[:, 2],
+    })
+
+
+# Cuts every mask of an (N, H, W) stack to its bounding box, found for the whole stack at once from the row and
+# column projections, so the contour search in measure_mask_yolo() only scans the object.
+# Called in yolo_masks_from_result()
+def crop_masks_to_boxes(masks):
+    rows, cols = masks.any(axis=2), masks.any(axis=1)
+    crops = []
+    for mask, row, col in zip(masks, rows, cols):
+        ys, xs = np.flatnonzero(row), np.flatnonzero(col)
+        crops.append(mask[ys[0]:ys[-1] + 1, xs[0]:xs[-1] + 1] if len(ys) else mask[:1, :1])
+    return crops
 
 
 # Measures a binary mask and returns a tuple of the area, width, length, and compactness in pixels.
-# Called in run_yolo_segmentation()
+# The mask is padded with an empty border so that cropped masks give the same contour as the full-size mask.
+# Called in measure_yolo_objects()
 def measure_mask_yolo(mask):
 
-    mask_uint8 = (mask * 255).astype(np.uint8)
+    mask_uint8 = np.pad((mask * 255).astype(np.uint8), 1)
     contours, _ = cv2.findContours(mask_uint8, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
     if not contours:
@@ -343,175 +625,123 @@ def measure_mask_yolo(mask):
     return area, width, length, compactness
 
 
-# Run YOLO segmentation model on an image and process results.
-# Called in segmentation after mask paths are returned
-def run_yolo_segmentation(model_path, image_path, output_img_dir, plate_name, well_site, wavelength):
-    # Load YOLO model
-    model = YOLO(str(model_path))
-
-    # Create output directory for prediction images
-    output_img_dir.mkdir(parents=True, exist_ok=True)
-
-    # Run inference - save prediction images with bounding boxes
-    # YOLO will create a subdirectory with the name parameter
-    run_name = f"{plate_name}_{well_site}_w{wavelength}"
-    results = model.predict(
-        source=str(image_path),
-        save=True,
-        project=str(output_img_dir),
-        name=run_name,
-        exist_ok=True
-    )
-    
-    # Move prediction image from nested folder to img folder directly
-    nested_folder = output_img_dir / run_name
-    if nested_folder.exists():
-        # Find the prediction image (usually a jpg or png)
-        for img_file in nested_folder.glob('*'):
-            if img_file.is_file() and img_file.suffix.lower() in ['.jpg', '.jpeg', '.png']:
-                # Move to parent img directory with descriptive name
-                dest_path = output_img_dir / f"{run_name}{img_file.suffix}"
-                shutil.move(str(img_file), str(dest_path))
-        
-        # Remove the now-empty nested folder
-        try:
-            nested_folder.rmdir()
-        except OSError:
-            # Folder not empty or other error, leave it
-            pass
-    
-    # Process results
-    masks_data = []
-    
-    for result in results:
-        if not result.masks:
-            continue
-        
-        # Extract confidence scores and class IDs if available
-        confidences = result.boxes.conf.cpu().numpy() if result.boxes is not None else []
-        class_ids = result.boxes.cls.cpu().numpy() if result.boxes is not None else [] 
-
-        for i, mask in enumerate(result.masks.data):
-            mask_np = mask.cpu().numpy()
-            
-            # Measure the mask
-            area, width, length, compactness = measure_mask_yolo(mask_np)
-            
-            # Get confidence score for this detection (default to 0.0 if not available)
-            confidence = float(confidences[i]) if i < len(confidences) else 0.0
-
-            # Get class ID and class name for this detection
-            class_id = int(class_ids[i]) if i < len(class_ids) else -1
-            class_name = model.names[class_id] if class_id >= 0 and class_id in model.names else "unknown"
-            
-            masks_data.append({
-                'mask': mask_np,
-                'mask_id': i + 1,
-                'area': area,
-                'width': width,
-                'length': length,
-                'compactness': compactness,
-                'confidence': confidence,
-                'class_id': class_id,
-                'class_name': class_name
-            })
-    
-    return masks_data
+# Measures every object of a Cellpose mask in one regionprops_table pass. The mask is already a label image (one value
+# per object), so it is measured as is rather than relabelled. Objects are numbered in raster order of their first
+# pixel, as measure.label numbers them, so object_number matches the relabelled numbering used before.
+# Called in segmentation()
+def measure_cellpose_objects(label_image, well_site):
+    props = measure.regionprops_table(label_image, properties=('area', 'perimeter'))
+
+    # regionprops_table lists objects in ascending label order, as np.unique does; reorder them by their first pixel
+    flat = label_image.ravel()
+    nonzero = np.flatnonzero(flat)
+    _, first = np.unique(flat[nonzero], return_index=True)
+    order = np.argsort(nonzero[first])
+
+    area = props['area'][order]
+    return pd.DataFrame({
+        'well_site': well_site,
+        'object_number': np.arange(1, len(area) + 1),
+        'size': area,
+        'compactness': props['perimeter'][order] ** 2 / (4 * np.pi * area.astype(float)),
+    })
+
+
+# Saves the labelled mask PNG (matching the cellpose format) as '{name}.png' and returns the segmentation metrics of
+# the image as a DataFrame (a single row of NAs if nothing was detected).
+# Called in segmentation() and segmentation_yolo_plate()
+def write_yolo_outputs(work_dir, name, well_site, labeled_image, objects):
+    if len(objects):
+        # Scale labeled image for visibility (multiply by 255 so objects are visible)
+        labeled_image_scaled = labeled_image * 255
+
+        # Save labeled mask PNG to work directory
+        mask_path = work_dir / f"{name}.png"
+        cv2.imwrite(str(mask_path), labeled_image_scaled.astype(np.uint16))
+
+        df = objects.copy()
+        df.insert(0, 'well_site', well_site)
+    else:
+        # No masks detected
+        df = pd.DataFrame([{
+            'well_site': well_site,
+            'object_number': "NA",
+            'size': "NA",
+            'compactness': "NA",
+            'width_px': "NA",
+            'length_px': "NA",
+            'confidence': "NA",
+            'class_id': "NA",
+            'class_name': "NA"
+        }])
+
+    return df
+
+
+# Saves the segmentation metrics of all timepoints of a well_site and wavelength to a single CSV.
+# results is a list of (timepoint, DataFrame) pairs. A timepoint column is added when more than one timepoint is
+# segmented, so single-timepoint CSVs keep their original columns.
+# Called in segmentation() and segmentation_yolo_plate()
+def write_segmentation_csv(g, work_dir, well_site, wavelength, results, timepoints):
+    tables = []
+    for timepoint, df in sorted(results, key=lambda result: result[0]):
+        if len(timepoints) > 1:
+            df = df.copy()
+            df.insert(1, 'timepoint', timepoint)
+        tables.append(df)
+
+    csv_outpath = work_dir / f'{g.plate}_{well_site}_w{wavelength + 1}.csv'
+    pd.concat(tables, ignore_index=True).to_csv(csv_outpath, index=False)
 
 
 # Creates a single labeled image where each mask has a unique pixel value to match the cellpose output format.
-# Called in segmentation after getting mask shape
-def create_labeled_mask_from_yolo(masks_data, image_shape):
+# Built in one pass over the (N, H, W) mask stack: where masks overlap, the later mask wins (mask ids are 1 to N).
+# Called in yolo_masks_from_result()
+def create_labeled_mask_from_yolo(masks):
+    binary = masks > 0.5
+    last = len(binary) - np.argmax(binary[::-1], axis=0)
+    return np.where(binary.any(axis=0), last, 0).astype(np.uint16)
+
+
+# Stitches the YOLO prediction images of all wells into one plate image per wavelength, named {plate}_w{n}_predicted.png.
+# Each well image is read once and copied straight into a preallocated plate canvas, which is written once at the end.
+# Wells without a prediction image are left blank.
+# Called in wrapper.py once all well_sites have been processed
+def stitch_yolo_predictions(g, wells, wavelengths, output_dir):
+    img_dir = Path(output_dir) / 'img'
+    if not img_dir.exists():
+        print(f"Image directory {img_dir} does not exist, skipping stitching")
+        return []
 
-    labeled_image = np.zeros(image_shape, dtype=np.uint16)
-    
-    for mask_info in masks_data:
-        mask = mask_info['mask']
-        mask_id = mask_info['mask_id']
-        
-        # Assign unique label to each mask
-        labeled_image[mask > 0.5] = mask_id
-    
-    return labeled_image
+    outpaths = []
+    for wavelength in wavelengths:
+        plate_image = None
+        n_stitched = 0
+        for well in wells:
+            image_path = img_dir / f"{g.plate}_{well}_w{wavelength + 1}.png"
+            if not image_path.exists():
+                continue
+            well_image = cv2.imread(str(image_path), cv2.IMREAD_COLOR)
+
+            # Allocate the plate canvas from the size of the first well image
+            if plate_image is None:
+                height, width = well_image.shape[:2]
+                plate_image = np.zeros((g.rows * height, g.cols * width, 3), dtype=np.uint8)
+            elif well_image.shape[:2] != (height, width):
+                well_image = cv2.resize(well_image, (width, height), interpolation=cv2.INTER_NEAREST)
+
+            # Well names are a row letter followed by a column number (e.g., A01)
+            row_index, col_index = ord(well[0].upper()) - ord('A'), int(well[1:]) - 1
+            plate_image[row_index * height:(row_index + 1) * height, col_index * width:(col_index + 1) * width] = well_image
+            n_stitched += 1
+
+        if plate_image is None:
+            print(f"No prediction images found in {img_dir} for wavelength {wavelength + 1}")
+            continue
 
+        outpath = Path(output_dir) / f"{g.plate}_w{wavelength + 1}_predicted.png"
+        cv2.imwrite(str(outpath), plate_image)
+        outpaths.append(outpath)
+        print(f"Stitched {n_stitched} prediction images to {outpath}")
 
-# Check if all wells have been processed and stitch YOLO prediction images
-# Called at the end of YOLO segmentation for each well
-def stitch_yolo_predictions(g, wavelength, output_dir):
-    img_dir = output_dir / 'img'
-    
-    # Only proceed if img directory exists
-    if not img_dir.exists():
-        print(f"Image directory {img_dir} does not exist, skipping stitching")
-        return
-    
-    # Determine which wells to check (handle 'All' case)
-    if g.wells == ['All']:
-        # Generate all well names based on plate dimensions
-        from preprocessing.utilities import get_wells
-        wells, _ = get_wells(g)
-    else:
-        wells = g.wells
-    
-    # Determine file format by looking for any prediction images
-    # Check for both jpg and png
-    all_prediction_files = list(img_dir.glob(f"{g.plate}_*_w{wavelength + 1}.*"))
-    
-    if not all_prediction_files:
-        print(f"No prediction images found in {img_dir} for wavelength {wavelength + 1}")
-        return
-    
-    # Determine the actual format being used
-    file_format = all_prediction_files[0].suffix.lstrip('.')
-    print(f"Found {len(all_prediction_files)} prediction images in {file_format} format")
-    
-    # Check if all expected prediction images exist
-    all_wells_complete = True
-    missing_wells = []
-    for well in wells:
-        expected_file = img_dir / f"{g.plate}_{well}_w{wavelength + 1}.{file_format}"
-        if not expected_file.exists():
-            all_wells_complete = False
-            missing_wells.append(well)
-    
-    if not all_wells_complete:
-        # Not all wells processed yet, skip stitching
-        return
-    
-    # Check if we've already stitched this wavelength (avoid duplicate stitching)
-    predicted_output = output_dir / f"{g.plate}_w{wavelength + 1}_predicted.{file_format}"
-    if predicted_output.exists():
-        print(f"Prediction image already stitched: {predicted_output}")
-        return
-    
-    try:
-        print(f"All wells complete for wavelength {wavelength + 1}. Stitching {len(wells)} prediction images...")
-        
-        # Call static_dx to stitch the images
-        outpaths = static_dx(
-            g,
-            wells,
-            img_dir,
-            output_dir,
-            None,
-            [wavelength],
-            rescale_factor=1,
-            format=file_format,
-            name_base=g.plate,  # YOLO prediction images are named with the unique plate
-        )
-        
-        # Rename the output file to include "_predicted" suffix
-        for outpath in outpaths:
-            if os.path.exists(outpath):
-                path_obj = Path(outpath)
-                new_name = f"{path_obj.stem}_predicted{path_obj.suffix}"
-                new_path = path_obj.parent / new_name
-                os.rename(outpath, new_path)
-                print(f"✓ Stitched prediction image saved to: {new_path}")
-            else:
-                print(f"Warning: Expected output path does not exist: {outpath}")
-                
-    except Exception as e:
-        print(f"Error stitching YOLO prediction images: {e}")
-        import traceback
-        traceback.print_exc()
+    return outpaths
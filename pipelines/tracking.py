@@ -1,11 +1,19 @@
+import atexit
+from collections import deque
+import cv2
+import hashlib
 import imageio.v3 as iio
-import matplotlib.patches as patches
-import matplotlib.pyplot as plt
+import multiprocessing
+from multiprocessing import shared_memory
 import numpy as np
+import os
+import pandas as pd
 import time
 import trackpy as tp
 from pathlib import Path
 
+from preprocessing.motion import frame_difference_score
+
 ###########################################
 ######### TRACKING MAIN FUNCTION  #########
 ###########################################
@@ -31,61 +39,56 @@ def tracking(g, options, well_site):
     else:
         wavelengths = [int(w[1:]) - 1 for w in wavelengths_option.split(',')]
 
-    # List all timepoint folders in order
-    timepoints = sorted(Path(g.input, g.plate).glob("TimePoint_*"))
+    # Motion-adaptive mode: static frames reuse the features of the previous frame instead of being located again
+    adaptive = options.get('adaptive', False)
+
+    # Cache located features in 'work/tracking/features'
+    use_feature_cache = options.get('feature_cache', True)
+
+    # List all timepoint folders in numerical order
+    timepoints = sorted(Path(g.input, g.plate).glob("TimePoint_*"), key=lambda p: int(p.name.split('_')[-1]))
 
     # Process each wavelength
     for wavelength in wavelengths:
-        image_sequence = []  # Store images for Trackpy
-
+        # Find the image for this well site at each timepoint
+        image_paths = []
         for timepoint_folder in timepoints:
-            # Find image for this well site at the current timepoint
             image_path = list(timepoint_folder.glob(f"{g.plate_short}_{well_site}_w{wavelength + 1}*.TIF"))
-            
-            # Load image as 16-bit and normalize to 8-bit
-            img = iio.imread(str(image_path[0]))
-            img_8bit = (img / img.max() * 255).astype(np.uint8)
-
-            image_sequence.append(img_8bit)
+            if image_path:
+                image_paths.append(image_path[0])
 
         # If no valid images, skip tracking
-        if not image_sequence:
+        if not image_paths:
             print(f"Skipping well {well_site} for wavelength {wavelength + 1} (no images found).")
             continue
-        
-        # Convert list to NumPy array (frames x height x width)
-        video = np.stack(image_sequence, axis=0)
 
         # Extract dimensions
-        num_frames, height, width = video.shape
+        num_frames = len(image_paths)
+        height, width = iio.improps(str(image_paths[0])).shape[:2]
 
         print(f"Tracking {num_frames} frames for well {well_site}, wavelength {wavelength + 1}...")
 
-        # Track worms using Trackpy
-        f = tp.batch(video, diameter=options['diameter'], invert=True, minmass=options['minmass'], noise_size=options['noisesize'], processes='auto')
-        t = tp.link(f, search_range=options['searchrange'], memory=options['memory'], adaptive_stop=options['adaptivestop'])
+        # Track worms using Trackpy: features are located frame by frame and fed incrementally to linking,
+        # so only one frame is held in memory at a time. Located features are cached so that reruns which only
+        # change the linking parameters (searchrange, memory, adaptivestop) skip straight to linking.
+        # Downsampled features are already in full-resolution coordinates, so searchrange is used as is.
+        cache_path = feature_cache_path(img_output_dir, g, well_site, wavelength, image_paths, options, adaptive)
+        if use_feature_cache and cache_path.exists():
+            print(f"Using cached features from {cache_path.name}.")
+            features = read_feature_cache(cache_path)
+        elif use_feature_cache:
+            features = write_feature_cache(locate_features(image_paths, options, adaptive), cache_path)
+        else:
+            features = locate_features(image_paths, options, adaptive)
+        linked = tp.link_df_iter(features, search_range=options['searchrange'], memory=options['memory'], adaptive_stop=options['adaptivestop'])
+        linked = list(linked)
+        t = pd.concat(linked, ignore_index=True) if linked else pd.DataFrame(columns=['y', 'x', 'frame', 'particle'])
 
         print(f'Plotting trajectories...')
 
         # Save PNGs of the tracking results
         track_png_work = img_output_dir / f"{g.plate}_{well_site}_w{wavelength + 1}.png"
-
-        dpi = 300
-        fig = plt.figure(figsize=(2048/dpi, 2048/dpi), dpi=dpi)
-        ax = plt.gca()
-        ax.set_xlim([0, width])
-        ax.set_ylim([0, height])
-        ax.set_aspect('equal', adjustable='box')
-
-        # Add circular well boundary for reference
-        radius = height / 2
-        circle = patches.Circle((radius, radius), radius, fill=False)
-        ax.add_patch(circle)
-        ax.axis('off')
-
-        # Plot trajectories on the figure
-        tp.plot_traj(t, ax=ax)
-        fig.savefig(track_png_work)
+        render_trajectories(t, width, height, track_png_work)
 
         print(f'Tracking for well {well_site}, wavelength {wavelength + 1} completed in {time.time() - start_time:.2f} seconds.')
 
@@ -96,3 +99,344 @@ def tracking(g, options, well_site):
         t.to_csv(str(tracks_csv_path), index=False)
 
     return wavelengths
+
+
+##############################################
+######### TRACKING HELPER FUNCTIONS  #########
+##############################################
+
+# Lookup of v * 255 for every 16-bit grey level, used to normalise frames to 8-bit without float temporaries
+LEVELS_X255 = np.arange(65536, dtype=np.uint32) * 255
+
+
+# Normalises an image to 8-bit by its maximum (equivalent to img / img.max() * 255) and writes it into out.
+# Unsigned integer images go through an integer lookup table instead of float64 division.
+# Called in locate_features()
+def normalize_to_8bit(img, out):
+    img_max = int(img.max())
+    if img_max == 0:
+        out[...] = 0
+    elif img.dtype.kind == 'u' and img.dtype.itemsize <= 2:
+        lut = (LEVELS_X255[:img_max + 1] // img_max).astype(np.uint8)
+        np.take(lut, img, out=out, mode='clip')
+    else:
+        out[...] = img / img_max * 255
+    return out
+
+
+# Generator that streams a well's frames and yields the located features of each frame (with a 'frame' column).
+# Frames are normalised to 8-bit straight into the pool's shared memory slots and located on the persistent locate pool,
+# with up to two frames per worker in flight; only the slots and the current frame are held in memory.
+# With processes set to 1, frames are located in this process using a single preallocated buffer.
+# In adaptive mode, frames that did not change from the previous frame reuse its features, and moving frames are
+# located every pair_stride frames (the ones in between are dropped).
+# With a downsample factor above 1, frames are shrunk by that factor before locating and the features are mapped back
+# to full-resolution coordinates, so linking and the CSV are unchanged.
+# Called in tracking()
+def locate_features(image_paths, options, adaptive=False):
+    motion_threshold = options.get('motion_threshold', 0.05)
+    pair_stride = max(1, int(options.get('pair_stride', 1)))
+    downsample = max(1, int(options.get('downsample', 1)))
+    locate_kwargs = scale_locate_params(options, downsample)
+    processes = options.get('processes', 'auto')
+    pool = get_locate_pool(processes) if processes not in (0, 1) else None
+
+    frame_8bit = None
+    free_slots, has_slots = deque(), False
+    pending = deque()  # frames in flight as (frame, features or AsyncResult or None to reuse the previous features, slot)
+    last_features = [None]
+    previous_img = None
+    has_source = False  # False if the last moving frame was dropped, so static frames have no features to reuse
+    motile_pairs = 0
+
+    try:
+        for frame, image_path in enumerate(image_paths):
+            img = iio.imread(str(image_path))
+
+            if adaptive and previous_img is not None:
+                # Score motion on the raw frames so the threshold matches optical_flow
+                score = frame_difference_score(previous_img, img)
+                previous_img = img
+                if score < motion_threshold:
+                    if has_source:
+                        pending.append((frame, None, None))
+                    continue
+                motile_pairs += 1
+                if (motile_pairs - 1) % pair_stride != 0:
+                    has_source = False
+                    continue
+            previous_img = img
+            has_source = True
+
+            # Shrink the frame before normalising so only the downsampled pixels are processed
+            if downsample > 1:
+                img = downsample_frame(img, downsample)
+
+            # Load image as 16-bit and normalize to 8-bit
+            if pool is None:
+                if frame_8bit is None:
+                    frame_8bit = np.empty(img.shape, dtype=np.uint8)
+                normalize_to_8bit(img, frame_8bit)
+                pending.append((frame, locate_frame(frame_8bit, locate_kwargs, downsample), None))
+            else:
+                if not has_slots:
+                    free_slots.extend(get_locate_slots(img.size))
+                    has_slots = True
+                while not free_slots:
+                    features = resolve_oldest_frame(pending, free_slots, last_features)
+                    if len(features):
+                        yield features
+                slot = free_slots.popleft()
+                normalize_to_8bit(img, np.ndarray(img.shape, dtype=np.uint8, buffer=slot.buf))
+                pending.append((frame, pool.apply_async(locate_shared_frame, (slot.name, img.shape, locate_kwargs, downsample)), slot))
+
+            # In-process frames are yielded straight away; pooled frames once their slot is needed again
+            while pending and pool is None:
+                features = resolve_oldest_frame(pending, free_slots, last_features)
+                if len(features):
+                    yield features
+
+        while pending:
+            features = resolve_oldest_frame(pending, free_slots, last_features)
+            if len(features):
+                yield features
+    finally:
+        # If the generator is closed early, let the frames still in flight finish before their slots are reused
+        for task in pending_tasks(pending):
+            task.wait()
+
+
+# Pops the oldest in-flight frame, waits for its features and returns them with a 'frame' column.
+# Reused frames copy the features of the last resolved frame. Frees the frame's shared memory slot.
+# Frames without features are left out by the caller, as they would be from a tp.batch DataFrame.
+# Called in locate_features()
+def resolve_oldest_frame(pending, free_slots, last_features):
+    frame, located, slot = pending.popleft()
+    if located is None:
+        return last_features[0].assign(frame=frame)
+    features = located if isinstance(located, pd.DataFrame) else located.get()
+    if slot is not None:
+        free_slots.append(slot)
+    features['frame'] = frame
+    last_features[0] = features
+    return features
+
+
+# Returns the locate pool results of the in-flight frames that are still being located.
+# Called in locate_features()
+def pending_tasks(pending):
+    return [located for _, located, _ in pending if located is not None and not isinstance(located, pd.DataFrame)]
+
+
+# Process pool reused by every well_site and wavelength to locate features (created on first use)
+LOCATE_POOL = None
+LOCATE_POOL_SIZE = 0
+
+# Shared memory slots (two per pool worker) that frames are passed to the pool in. Kept with the pool, so every
+# well_site reuses the same buffers; they are released by close_locate_pool().
+LOCATE_SLOTS = []
+
+
+# Returns the persistent locate pool, creating it on first use. 'auto' uses all available cores, since wells are
+# processed one at a time by wrapper.py.
+# Called in locate_features()
+def get_locate_pool(processes):
+    global LOCATE_POOL, LOCATE_POOL_SIZE
+    if LOCATE_POOL is None:
+        LOCATE_POOL_SIZE = os.cpu_count() if processes == 'auto' else int(processes)
+        print(f"Starting trackpy locate pool with {LOCATE_POOL_SIZE} processes.")
+        LOCATE_POOL = multiprocessing.Pool(LOCATE_POOL_SIZE)
+        atexit.register(close_locate_pool)
+    return LOCATE_POOL
+
+
+# Returns the shared memory slots for frames of nbytes bytes, creating them on first use. The slots are only
+# replaced (with larger ones) when a frame does not fit, e.g. a wavelength or plate with larger images.
+# Called in locate_features()
+def get_locate_slots(nbytes):
+    global LOCATE_SLOTS
+    if LOCATE_SLOTS and LOCATE_SLOTS[0].size < nbytes:
+        release_locate_slots()
+    if not LOCATE_SLOTS:
+        LOCATE_SLOTS = [shared_memory.SharedMemory(create=True, size=nbytes) for _ in range(2 * LOCATE_POOL_SIZE)]
+    return LOCATE_SLOTS
+
+
+# Closes and unlinks the shared memory slots.
+# Called in get_locate_slots() and close_locate_pool()
+def release_locate_slots():
+    global LOCATE_SLOTS
+    for slot in LOCATE_SLOTS:
+        slot.close()
+        slot.unlink()
+    LOCATE_SLOTS = []
+
+
+# Shuts down the persistent locate pool and releases its shared memory slots once the workers have exited.
+# Called in wrapper.py once all well_sites have been processed
+def close_locate_pool():
+    global LOCATE_POOL
+    if LOCATE_POOL is not None:
+        LOCATE_POOL.close()
+        LOCATE_POOL.join()
+        LOCATE_POOL = None
+    release_locate_slots()
+
+
+# Locates features in an 8-bit frame held in shared memory. Runs in a locate pool worker.
+# Called in locate_features()
+def locate_shared_frame(shm_name, shape, locate_kwargs, downsample=1):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frame = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    features = locate_frame(frame, locate_kwargs, downsample)
+    del frame
+    shm.close()
+    return features
+
+
+# Returns the trackpy locate settings for frames downsampled by the given factor.
+# Lengths are divided by the factor (diameter is kept odd and at least 3 px, as trackpy requires) and minmass,
+# which is integrated over the feature's area, by the factor squared.
+# Called in locate_features()
+def scale_locate_params(options, downsample=1):
+    diameter = int(round(options['diameter'] / downsample))
+    if diameter % 2 == 0:
+        diameter += 1
+    return {
+        'diameter': max(3, diameter) if downsample > 1 else options['diameter'],
+        'invert': True,
+        'minmass': options['minmass'] / downsample**2,
+        'noise_size': options['noisesize'] / downsample,
+    }
+
+
+# Shrinks a frame by an integer factor with area averaging. Rows and columns that do not fill a whole block are
+# cropped, so each downsampled pixel is the mean of exactly downsample x downsample full-resolution pixels.
+# Called in locate_features()
+def downsample_frame(img, downsample):
+    height, width = img.shape[0] // downsample, img.shape[1] // downsample
+    img = img[:height * downsample, :width * downsample]
+    return cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+
+
+# Locates features in an 8-bit frame and maps them back to full-resolution coordinates if the frame was downsampled.
+# The centre of downsampled pixel i is at (i + 0.5) * downsample - 0.5 in the full-resolution frame.
+# Called in locate_features() and locate_shared_frame()
+def locate_frame(frame, locate_kwargs, downsample=1):
+    features = tp.locate(frame, **locate_kwargs)
+    if downsample > 1:
+        features['x'] = (features['x'] + 0.5) * downsample - 0.5
+        features['y'] = (features['y'] + 0.5) * downsample - 0.5
+        features['size'] = features['size'] * downsample
+    return features
+
+
+# Returns the path of the feature cache for a well_site and wavelength. The name encodes every setting that changes
+# which features are located, so a different diameter/minmass/noisesize (or adaptive/downsample setting) uses a new cache.
+# It also ends with a hash of the input frames (see frames_cache_key()), so re-cropped or re-masked frames are located again.
+# Called in tracking()
+def feature_cache_path(work_dir, g, well_site, wavelength, image_paths, options, adaptive):
+    key = f"d{options['diameter']}_m{options['minmass']}_n{options['noisesize']}_t{len(image_paths)}"
+    downsample = max(1, int(options.get('downsample', 1)))
+    if downsample > 1:
+        key += f"_f{downsample}"
+    if adaptive:
+        key += f"_a{options.get('motion_threshold', 0.05)}_s{options.get('pair_stride', 1)}"
+    key += f"_{frames_cache_key(g, image_paths)}"
+    return Path(work_dir) / 'features' / f"{g.plate}_{well_site}_w{wavelength + 1}_{key}.parquet"
+
+
+# Returns a short hash of the input frames of a feature cache: the well crop and mask settings (circle_diameter,
+# square_side, multi-well detection) and the name, size and modification time of every frame. Cropping and masking
+# rewrite the frames, so a rerun with other settings gets a new key without reading the images.
+# Called in feature_cache_path()
+def frames_cache_key(g, image_paths):
+    digest = hashlib.sha256(f"{g.circle_diameter};{g.square_side};{g.crop};{g.multi_well_detection}".encode())
+    for image_path in image_paths:
+        stat = os.stat(image_path)
+        digest.update(f";{Path(image_path).name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:12]
+
+
+# Passes located features through to linking and writes them to a parquet file once all frames are located.
+# Called in tracking()
+def write_feature_cache(features_iter, cache_path):
+    located = []
+    for features in features_iter:
+        located.append(features)
+        yield features
+
+    if not located:
+        return
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        pd.concat(located, ignore_index=True).to_parquet(cache_path, index=False)
+    except ImportError as e:
+        print(f"Could not cache tracking features (parquet support is not installed): {e}")
+
+
+# Generator that replays cached features frame by frame in the same form as locate_features().
+# Called in tracking()
+def read_feature_cache(cache_path):
+    cached = pd.read_parquet(cache_path)
+    for _, features in cached.groupby('frame', sort=True):
+        yield features.reset_index(drop=True)
+
+
+# Matplotlib's default colour cycle (tab10) as BGR, so trajectories are coloured as they were with tp.plot_traj
+TRAJECTORY_COLOURS = [
+    (180, 119, 31), (14, 127, 255), (44, 160, 44), (40, 39, 214), (189, 103, 148),
+    (75, 86, 140), (194, 119, 227), (127, 127, 127), (34, 189, 188), (207, 190, 23),
+]
+
+
+# Draws the circular well boundary and the trajectory of each particle directly into a size x size canvas and writes it
+# as a PNG. The layout matches the previous matplotlib figure (2048 px at 300 dpi with default axes margins), with
+# trajectories in image coordinates. Memory use is constant across a plate since no figures are created.
+# Called in tracking()
+def render_trajectories(t, width, height, outpath, size=2048):
+    canvas = np.full((size, size, 3), 255, dtype=np.uint8)
+
+    # Default matplotlib axes box (left 0.125, right 0.9, bottom 0.11, top 0.88), shrunk to an equal aspect ratio
+    box_x, box_y = 0.125 * size, (1 - 0.88) * size
+    box_w, box_h = (0.9 - 0.125) * size, (0.88 - 0.11) * size
+    scale = min(box_w / width, box_h / height)
+    offset_x = box_x + (box_w - width * scale) / 2
+    offset_y = box_y + (box_h - height * scale) / 2
+
+    # Line widths of 1.5 pt (lines) and 1 pt (patches) at 300 dpi
+    line_width = max(1, round(6.25 * size / 2048))
+    edge_width = max(1, round(4.2 * size / 2048))
+
+    # Coordinates are drawn with 4 bits of sub-pixel precision
+    shift = 4
+    radius = height / 2
+    centre = (int(round((offset_x + radius * scale) * 2**shift)), int(round((offset_y + radius * scale) * 2**shift)))
+    cv2.circle(canvas, centre, int(round(radius * scale * 2**shift)), (0, 0, 0), edge_width, cv2.LINE_AA, shift)
+
+    if len(t):
+        # Sort points by particle then frame and split them into one polyline per particle
+        t = t.sort_values(['particle', 'frame'], kind='stable')
+        particles = t['particle'].to_numpy()
+        points = np.empty((len(t), 2), dtype=np.int32)
+        points[:, 0] = np.round((offset_x + t['x'].to_numpy(dtype=float) * scale) * 2**shift)
+        points[:, 1] = np.round((offset_y + t['y'].to_numpy(dtype=float) * scale) * 2**shift)
+
+        # Colours cycle by particle, as matplotlib cycled them over the particle columns
+        _, particle_index = np.unique(particles, return_inverse=True)
+
+        # Tracks are also broken where a particle is missing from a frame (memory gaps), as the NaNs of the matplotlib
+        # plot broke the line. Frames are ranked among the frames that have features, as in tp.plot_traj.
+        frame_rank = np.searchsorted(np.unique(t['frame'].to_numpy()), t['frame'].to_numpy())
+        breaks = np.flatnonzero((np.diff(particles) != 0) | (np.diff(frame_rank) != 1)) + 1
+        starts = np.concatenate(([0], breaks))
+        segments = np.split(points, breaks)
+        segment_colours = particle_index[starts] % len(TRAJECTORY_COLOURS)
+
+        # Draw all segments of the same colour in one call (single points are not drawn, as with a line plot)
+        for colour_index, colour in enumerate(TRAJECTORY_COLOURS):
+            colour_segments = [segment for segment, c in zip(segments, segment_colours) if c == colour_index and len(segment) > 1]
+            if colour_segments:
+                cv2.polylines(canvas, colour_segments, False, colour, line_width, cv2.LINE_AA, shift)
+
+    cv2.imwrite(str(outpath), canvas)
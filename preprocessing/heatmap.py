@@ -0,0 +1,34 @@
+from matplotlib import cm
+from PIL import Image
+import numpy as np
+from scipy import ndimage
+
+##########################################
+######### HEATMAP MAIN FUNCTIONS #########
+##########################################
+
+# Rescales a summed motion image, blurs it, and saves it as an inferno-coloured PNG heatmap.
+# Shared by the motility pipelines. Called in optical_flow() and frame_difference()
+def save_motility_heatmap(sum_img, outpath, multiplier):
+    # Rescaling if required
+    sum_img = sum_img * multiplier
+    pixel_max = np.amax(sum_img)
+
+    # If there is not a single saturated pixel (low flow), set one to 255 in order to prevent rescaling
+    if pixel_max < 255:
+        print(f"Max flow is {pixel_max}. Rescaling")
+        sum_img[0, 0] = 255
+    # If there are saturated pixels (high flow), adjust everything > 255 to prevent rescaling
+    elif pixel_max > 255:
+        print(f"Max flow is {pixel_max}. Rescaling")
+        sum_img[sum_img > 255] = 255
+    else:
+        print("Something went wrong.")
+
+    # Apply Gaussian filter
+    sum_blur = ndimage.filters.gaussian_filter(sum_img, 1.5)
+
+    # Apply PIL colourmap
+    new_im = np.asarray(sum_blur) / 255
+    sum_blur_colour = Image.fromarray(np.uint8(cm.inferno(new_im) * 255))
+    sum_blur_colour.save(outpath)
@@ -7,6 +7,8 @@ import shutil
 import yaml
 from PIL import Image
 
+from preprocessing.masks import get_mask
+
 ###################################################
 ######### IMAGE PROCESSING MAIN FUNCTIONS #########
 ###################################################
@@ -996,15 +998,13 @@ def __apply_mask(image, mask_size, type):
         # calculate the circle's radius
         radius = (height * mask_size) / 2
 
-        # create a circular mask
-        y, x = np.ogrid[:height, :width]
+        # get the cached circular mask (True within the circle); every image of the plate shares it
         center = (width // 2, height // 2)
-        # find squared distance of each coordinate from the centre and return True if it is within the mask area
-        mask_area = (x - center[0])**2 + (y - center[1])**2 > radius**2
+        mask = get_mask((height, width), center, radius, 'circle')
 
         # apply the mask to the image
         masked_array = np.array(image)
-        masked_array[mask_area] = 0
+        masked_array[~mask] = 0
         masked_image = Image.fromarray(masked_array, mode='I;16')
 
         return masked_image
@@ -1168,16 +1168,11 @@ def __extract_well_region(image, center_x, center_y, size, well_shape):
         rel_center_x = center_x - left
         rel_center_y = center_y - top
         
-        Y, X = np.ogrid[:np_img.shape[0], :np_img.shape[1]]
-        dist_from_center = np.sqrt((X - rel_center_x)**2 + (Y - rel_center_y)**2)
-        mask = dist_from_center <= size // 2
+        # wells are cropped at the same relative position every timepoint, so the cached mask is reused
+        mask = get_mask(np_img.shape, (rel_center_x, rel_center_y), size // 2, 'circle')
         
         masked_img = np_img.copy()
-        if len(np_img.shape) == 3:
-            for c in range(np_img.shape[2]):
-                masked_img[:,:,c][~mask] = 0
-        else:
-            masked_img[~mask] = 0
+        masked_img[~mask] = 0
         
         return Image.fromarray(masked_img)
     
@@ -0,0 +1,35 @@
+from functools import lru_cache
+import numpy as np
+
+########################################
+######### MASKS MAIN FUNCTIONS #########
+########################################
+
+# Returns a boolean mask of shape (height, width) that is True inside a well of the given type ('circle' or 'square')
+# centred on center (x, y) with the given radius (half the side length for squares).
+# Every well of a plate (and every timepoint) has the same mask, so masks are built once per
+# (shape, center, radius, type) and cached. The returned array is read-only and shared: combine it with an image
+# (e.g. image * mask or image[~mask] = 0), never modify it in place.
+# Called in create_circular_mask(), __apply_mask() and __extract_well_region()
+def get_mask(shape, center, radius, type='circle'):
+    height, width = shape[:2]
+    return __build_mask(int(height), int(width), float(center[0]), float(center[1]), float(radius), type)
+
+
+##########################################
+######### MASKS HELPER FUNCTIONS #########
+##########################################
+
+# Builds a mask for get_mask(). Circles compare squared distances against radius**2, so no square roots are taken.
+# Called in get_mask()
+@lru_cache(maxsize=16)
+def __build_mask(height, width, center_x, center_y, radius, type):
+    y, x = np.ogrid[:height, :width]
+    if type == 'circle':
+        mask = (x - center_x)**2 + (y - center_y)**2 <= radius**2
+    elif type == 'square':
+        mask = (np.abs(x - center_x) <= radius) & (np.abs(y - center_y) <= radius)
+    else:
+        raise ValueError(f"Unsupported mask type: {type}. Use 'circle' or 'square'.")
+    mask.flags.writeable = False
+    return mask
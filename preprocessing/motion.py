@@ -0,0 +1,44 @@
+import cv2
+import numpy as np
+
+#########################################
+######### MOTION MAIN FUNCTIONS #########
+#########################################
+
+# A pixel counts as changed when its absolute difference exceeds this multiple of the pair's median absolute
+# difference (about 4 standard deviations of camera noise)
+NOISE_MULTIPLIER = 6.0
+
+
+# Cheap motion score for a pair of frames: the percentage of pixels (inside the mask, if given) whose absolute difference
+# is above the noise level of the pair (see noise_level()).
+# Most pixels of a well are background, so the median measures camera noise: static frames score close to 0 whatever
+# the bit depth or brightness, while moving worms change pixels far above the noise.
+# Shared by the motion-adaptive modes. Called in optical_flow() and locate_features() (tracking)
+def frame_difference_score(frame1, frame2, mask=None):
+    values = pair_differences(frame1, frame2, mask)
+    if not values.size:
+        return 0.0
+
+    # The median of a regular subsample is enough to estimate the noise level
+    noise = noise_level(values[::16])
+    return 100.0 * np.count_nonzero(values > noise) / values.size
+
+
+# Returns the absolute differences of a pair of frames at the pixels that can show motion: inside the mask (if given)
+# and not zero in both frames (zero pixels are outside a masked well).
+# Called in frame_difference_score() and estimate_diff_threshold() (frame_difference)
+def pair_differences(frame1, frame2, mask=None):
+    diff = cv2.absdiff(frame1, frame2)
+    valid = (frame1 > 0) | (frame2 > 0)
+    if mask is not None:
+        valid &= mask
+    return diff[valid]
+
+
+# Noise level of a set of absolute frame differences: NOISE_MULTIPLIER times their median, at least 1 grey level.
+# Called in frame_difference_score() and estimate_diff_threshold() (frame_difference)
+def noise_level(values):
+    if not len(values):
+        return 1.0
+    return max(1.0, NOISE_MULTIPLIER * float(np.median(values)))
@@ -0,0 +1,78 @@
+import cv2
+import numpy as np
+
+######################################
+######### ROI MAIN FUNCTIONS #########
+######################################
+
+# Returns the bounding box (y0, y1, x0, x1) and boolean mask (None if the whole box is used) of the region to compute flow on.
+# 'mask' uses the configured circle_diameter/square_side (same geometry as apply_masks), 'auto' detects the well.
+# Square wells are only cropped where apply_masks did not already crop them.
+# Shared by the motility pipelines. Called in optical_flow() and frame_difference()
+def get_flow_roi(g, frame, roi):
+    height, width = frame.shape
+    full_frame = (0, height, 0, width), None
+
+    if roi == 'mask':
+        if g.circle_diameter != 'NA':
+            return circle_roi(height, width, (width // 2, height // 2), (height * g.circle_diameter) / 2)
+        elif g.square_side != 'NA':
+            # apply_masks has already cropped square wells to square_side, so the whole frame is the well.
+            # Only unstitched multi-site images (which apply_masks skips) still need cropping here.
+            if not (g.mode == 'multi-site' and g.stitch == False):
+                return full_frame
+            half_side = (height * g.square_side) / 2
+            y0, y1 = max(0, int(height / 2 - half_side)), min(height, int(np.ceil(height / 2 + half_side)))
+            x0, x1 = max(0, int(width / 2 - half_side)), min(width, int(np.ceil(width / 2 + half_side)))
+            return (y0, y1, x0, x1), None
+        print("No circle_diameter or square_side configured, computing flow on the whole frame.")
+        return full_frame
+
+    elif roi == 'auto':
+        return detect_well_roi(frame) or full_frame
+
+    return full_frame
+
+
+
+########################################
+######### ROI HELPER FUNCTIONS #########
+########################################
+
+# Returns the bounding box and mask of a circle with the given centre (x, y) and radius, clipped to the frame.
+# Called in get_flow_roi() and detect_well_roi()
+def circle_roi(height, width, center, radius):
+    y0, y1 = max(0, int(center[1] - radius)), min(height, int(np.ceil(center[1] + radius)) + 1)
+    x0, x1 = max(0, int(center[0] - radius)), min(width, int(np.ceil(center[0] + radius)) + 1)
+    y, x = np.ogrid[y0:y1, x0:x1]
+    mask = (x - center[0])**2 + (y - center[1])**2 <= radius**2
+    return (y0, y1, x0, x1), mask
+
+
+# Detects the well in a frame. Masked wells (see apply_masks) are found from their non-zero pixels,
+# otherwise the well is located with a Hough circle transform. Returns None if no well is found.
+# Called in get_flow_roi()
+def detect_well_roi(frame):
+    height, width = frame.shape
+
+    # Pixels outside a masked well are exactly zero; use the largest non-zero region
+    nonzero = (frame > 0).astype(np.uint8)
+    if 0 < cv2.countNonZero(nonzero) < frame.size:
+        contours, _ = cv2.findContours(nonzero, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        well = max(contours, key=cv2.contourArea)
+        x0, y0, w, h = cv2.boundingRect(well)
+        mask = np.zeros((h, w), dtype=np.uint8)
+        cv2.drawContours(mask, [well], -1, 1, thickness=cv2.FILLED, offset=(-x0, -y0))
+        return (y0, y0 + h, x0, x0 + w), mask.astype(bool)
+
+    # Unmasked frames: find the circle closest to the centre of the frame
+    gray = cv2.normalize(frame, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+    blurred = cv2.GaussianBlur(gray, (5, 5), 1)
+    side = min(height, width)
+    circles = cv2.HoughCircles(blurred, cv2.HOUGH_GRADIENT, dp=2, minDist=side // 2, param1=50, param2=30,
+                               minRadius=int(side * 0.3), maxRadius=int(side * 0.55))
+    if circles is None:
+        print("No well detected, computing flow on the whole frame.")
+        return None
+    cx, cy, radius = min(circles[0], key=lambda c: (c[0] - width / 2)**2 + (c[1] - height / 2)**2)
+    return circle_roi(height, width, (float(cx), float(cy)), float(radius))
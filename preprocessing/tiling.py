@@ -0,0 +1,13 @@
+#########################################
+######### TILING MAIN FUNCTIONS #########
+#########################################
+
+# Returns the start positions of tiles along one axis so that neighbouring tiles overlap by at least tile_overlap.
+# The last tile is aligned with the end of the axis.
+# Shared by the tiled pipelines. Called in calc_flow_magnitude() (optical_flow) and run_yolo_tiled() (segmentation)
+def tile_starts(length, tile_size, tile_overlap):
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, tile_size - tile_overlap))
+    starts.append(length - tile_size)
+    return starts
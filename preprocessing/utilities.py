@@ -316,3 +316,26 @@ def get_wells(g):
     well_sites = sorted(list(available_well_sites))
 
     return wells, well_sites
+
+
+# Parse a pipeline's timepoints option into a sorted list of timepoint numbers (TimePoint_1 is 1).
+# The option is 'All', a single timepoint, or a list of timepoints (e.g. [1, 5, 10] or ['1,5,10']).
+# Called in segmentation(), cellprofiler() and their plate-level Cellpose/YOLO functions
+def get_timepoints(g, timepoints_option=1):
+    values = timepoints_option if isinstance(timepoints_option, list) else [timepoints_option]
+    values = [v.strip() for v in ','.join(str(v) for v in values).split(',')]
+    if 'All' in values:
+        return list(range(1, g.time_points + 1))
+
+    timepoints = sorted({int(v) for v in values})
+    invalid = [t for t in timepoints if not 1 <= t <= g.time_points]
+    if invalid:
+        raise ValueError(f"Timepoints {invalid} are outside the {g.time_points} timepoints of plate {g.plate}.")
+    return timepoints
+
+
+# Suffix added to the names of per-timepoint work files (masks, prediction images).
+# TimePoint_1 keeps the plain name so that single-timepoint runs and static_dx see the same files as before.
+# Called in segmentation(), cellprofiler() and their plate-level Cellpose/YOLO functions
+def timepoint_suffix(timepoint):
+    return '' if timepoint == 1 else f'_t{timepoint}'
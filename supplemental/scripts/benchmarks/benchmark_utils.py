@@ -0,0 +1,73 @@
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# Make the wrmXpress pipelines importable when a benchmark is run from this folder
+REPO_DIR = Path(__file__).resolve().parents[3]
+if str(REPO_DIR) not in sys.path:
+    sys.path.insert(0, str(REPO_DIR))
+
+
+def synthetic_worm_frames(n_frames=10, height=1024, width=1024, n_worms=40, speed=2.0, static_fraction=0.0, seed=0):
+    """
+    Generate a (T, H, W) uint16 stack of dark, elongated "worms" moving over a bright, textured
+    well background. Worm positions follow a random walk of `speed` pixels per frame; a fraction
+    `static_fraction` of the worms never move (paralysed/dead worms).
+    """
+    rng = np.random.default_rng(seed)
+
+    background = cv2.GaussianBlur(rng.normal(0, 1, (height, width)).astype(np.float32), (0, 0), 8)
+    background = 30000 + 2000 * background / (np.abs(background).max() + 1e-6)
+
+    centres = rng.uniform([0.1 * width, 0.1 * height], [0.9 * width, 0.9 * height], (n_worms, 2))
+    angles = rng.uniform(0, np.pi, n_worms)
+    moving = rng.uniform(0, 1, n_worms) >= static_fraction
+    length = max(8, min(height, width) // 40)
+
+    frames = np.empty((n_frames, height, width), dtype=np.uint16)
+    for t in range(n_frames):
+        worms = np.zeros((height, width), dtype=np.float32)
+        for (cx, cy), angle in zip(centres, angles):
+            dx, dy = length * np.cos(angle), length * np.sin(angle)
+            cv2.line(worms, (int(cx - dx), int(cy - dy)), (int(cx + dx), int(cy + dy)), 1.0, max(2, length // 5))
+        worms = cv2.GaussianBlur(worms, (0, 0), 1.5)
+        noise = rng.normal(0, 150, (height, width)).astype(np.float32)
+        frames[t] = np.clip(background - 20000 * worms + noise, 0, 65535).astype(np.uint16)
+
+        steps = rng.normal(0, speed, (n_worms, 2)) * moving[:, None]
+        centres = np.clip(centres + steps, [0, 0], [width - 1, height - 1])
+        angles = angles + rng.normal(0, 0.1, n_worms) * moving
+
+    return frames
+
+
+def read_tif_stack(paths):
+    """Read a list of TIF paths into a (T, H, W) stack, preserving bit depth."""
+    return np.stack([cv2.imread(str(p), cv2.IMREAD_ANYDEPTH) for p in paths], axis=0)
+
+
+def time_call(fn, *args, repeats=3, **kwargs):
+    """Run fn(*args, **kwargs) `repeats` times and return (best wall time in seconds, last result)."""
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+# Default optical flow settings from master.yml
+FLOW_OPTIONS = {
+    "flow": None,
+    "pyrScale": 0.5,
+    "levels": 5,
+    "winsize": 20,
+    "iterations": 7,
+    "poly_n": 5,
+    "poly_sigma": 1.1,
+    "flags": 0,
+}
@@ -0,0 +1,116 @@
+import argparse
+import contextlib
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from benchmark_utils import FLOW_OPTIONS, synthetic_worm_frames
+from pipelines.frame_difference import estimate_diff_thresholds, frame_difference
+from pipelines.optical_flow import optical_flow
+
+
+def make_synthetic_plate(root, n_wells, n_frames, size):
+    """
+    Write a synthetic single-wavelength plate in ImageXpress layout under root/input/<plate>.
+    Wells range from completely static to highly motile. Returns the plate settings (g) and well names.
+    """
+    plate = "20250101-p01-BEN"
+    plate_dir = root / "input" / plate
+    wells = [f"{chr(65 + i // 12)}{i % 12 + 1:02d}" for i in range(n_wells)]
+    speeds = np.linspace(0, 4, n_wells)
+    for i, (well, speed) in enumerate(zip(wells, speeds)):
+        frames = synthetic_worm_frames(n_frames, size, size, n_worms=10, speed=speed, seed=i)
+        for t, frame in enumerate(frames):
+            timepoint_dir = plate_dir / f"TimePoint_{t + 1}"
+            timepoint_dir.mkdir(parents=True, exist_ok=True)
+            cv2.imwrite(str(timepoint_dir / f"{plate}_{well}_w1.TIF"), frame)
+
+    g = SimpleNamespace(
+        work=root / "work", output=root / "output", plate_dir=plate_dir, plate=plate, plate_short=plate,
+        n_waves=1, time_points=n_frames, circle_diameter="NA", square_side="NA",
+    )
+    return g, wells
+
+
+def run_pipeline(fn, g, options, wells, column, plate_setup=None):
+    """
+    Run a per-well motility pipeline over all wells (quietly) and return (seconds, {well: metric}).
+    plate_setup(g, options, wells) runs first, as wrapper.py does before the well loop, and is included in the time.
+    """
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if plate_setup is not None:
+            plate_setup(g, options, wells)
+        for well in wells:
+            fn(g, options, well)
+    elapsed = time.perf_counter() - start
+    work_dir = Path(g.work) / column
+    values = {well: pd.read_csv(work_dir / f"{g.plate}_{well}_w1.csv")[column].iloc[0] for well in wells}
+    return elapsed, values
+
+
+def benchmark(g, wells, diff_threshold):
+    flow_options = dict(FLOW_OPTIONS, wavelengths=["w1"])
+    diff_options = {"wavelengths": ["w1"], "diff_threshold": diff_threshold, "chunk_size": 16}
+
+    flow_time, flow = run_pipeline(optical_flow, g, flow_options, wells, "optical_flow")
+    diff_time, diff = run_pipeline(frame_difference, g, diff_options, wells, "frame_difference", estimate_diff_thresholds)
+
+    df = pd.DataFrame({"optical_flow": flow, "frame_difference": diff})
+    print(df.to_string())
+    print()
+    print(f"optical_flow:     {flow_time:.2f} s ({flow_time / len(wells):.3f} s/well)")
+    print(f"frame_difference: {diff_time:.2f} s ({diff_time / len(wells):.3f} s/well)")
+    print(f"speedup:          {flow_time / diff_time:.1f}x")
+    print(f"Pearson r:        {df['optical_flow'].corr(df['frame_difference'], method='pearson'):.3f}")
+    print(f"Spearman rho:     {df['optical_flow'].corr(df['frame_difference'], method='spearman'):.3f}")
+    return df
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description=(
+            "Compare the frame_difference motility metric with optical_flow totals: runtime per well and "
+            "Pearson/Spearman correlation across wells. Runs on a synthetic plate unless --plate-dir is given."
+        )
+    )
+    parser.add_argument("--plate-dir", type=Path, help="ImageXpress plate directory (TimePoint_* folders, single wavelength)")
+    parser.add_argument("--wells", nargs="+", help="Wells to compare (default: all wells found in TimePoint_1)")
+    parser.add_argument("--n-wells", type=int, default=24, help="Synthetic wells (default: 24)")
+    parser.add_argument("--n-frames", type=int, default=20, help="Synthetic timepoints (default: 20)")
+    parser.add_argument("--size", type=int, default=512, help="Synthetic well image size (default: 512)")
+    parser.add_argument("--diff-threshold", default="auto", help="frame_difference threshold (default: auto)")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    diff_threshold = args.diff_threshold if args.diff_threshold == "auto" else float(args.diff_threshold)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir)
+        if args.plate_dir:
+            plate_dir = args.plate_dir.resolve()
+            tifs = sorted((plate_dir / "TimePoint_1").glob("*_w1.TIF"))
+            plate_short = tifs[0].name.rsplit("_", 2)[0]
+            wells = args.wells or [t.name.rsplit("_", 2)[1] for t in tifs]
+            time_points = len(list(plate_dir.glob("TimePoint_*")))
+            g = SimpleNamespace(
+                work=root / "work", output=root / "output", plate_dir=plate_dir, plate=plate_dir.name,
+                plate_short=plate_short, n_waves=1, time_points=time_points, circle_diameter="NA", square_side="NA",
+            )
+        else:
+            g, wells = make_synthetic_plate(root, args.n_wells, args.n_frames, args.size)
+        benchmark(g, wells, diff_threshold)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,89 @@
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from benchmark_utils import FLOW_OPTIONS, read_tif_stack, synthetic_worm_frames, time_call
+from pipelines.optical_flow import calc_flow_magnitude
+from preprocessing.tiling import tile_starts
+
+
+def seam_mask(height, width, tile_size, tile_overlap):
+    """Boolean mask of the pixels covered by more than one tile (the blended seams)."""
+    coverage = np.zeros((height, width), dtype=np.uint8)
+    for y in tile_starts(height, tile_size, tile_overlap):
+        for x in tile_starts(width, tile_size, tile_overlap):
+            coverage[y:y + tile_size, x:x + tile_size] += 1
+    return coverage > 1
+
+
+def benchmark(frame1, frame2, tile_sizes, tile_overlap, workers, repeats):
+    """
+    Compare whole-frame Farneback flow against tiled flow for each tile size.
+    Returns a list of result dicts (one per tile size).
+    """
+    height, width = frame1.shape
+    whole_time, whole_mag = time_call(calc_flow_magnitude, frame1, frame2, FLOW_OPTIONS, repeats=repeats)
+    whole_total = float(whole_mag.sum())
+    print(f"Frame {width}x{height}: whole-frame flow {whole_time:.2f} s (total magnitude {whole_total:.4g})")
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for tile_size in tile_sizes:
+            overlap = min(tile_overlap, tile_size // 2)
+            tiled_time, tiled_mag = time_call(
+                calc_flow_magnitude, frame1, frame2, FLOW_OPTIONS, executor, tile_size, overlap, repeats=repeats
+            )
+            error = np.abs(tiled_mag - whole_mag)
+            seams = seam_mask(height, width, tile_size, overlap)
+            scale = float(whole_mag.mean()) + 1e-9
+            results.append({
+                "tile_size": tile_size,
+                "tile_overlap": overlap,
+                "time_s": tiled_time,
+                "speedup": whole_time / tiled_time,
+                "total_rel_error": abs(float(tiled_mag.sum()) - whole_total) / (whole_total + 1e-9),
+                "mean_rel_error": float(error.mean()) / scale,
+                "seam_rel_error": float(error[seams].mean()) / scale if seams.any() else 0.0,
+                "interior_rel_error": float(error[~seams].mean()) / scale,
+            })
+
+    print(f"{'tile':>6} {'overlap':>8} {'time_s':>8} {'speedup':>8} {'total_err':>10} {'mean_err':>9} {'seam_err':>9} {'inner_err':>9}")
+    for r in results:
+        print(f"{r['tile_size']:>6} {r['tile_overlap']:>8} {r['time_s']:>8.2f} {r['speedup']:>8.2f} "
+              f"{r['total_rel_error']:>10.2%} {r['mean_rel_error']:>9.2%} {r['seam_rel_error']:>9.2%} {r['interior_rel_error']:>9.2%}")
+    return results
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description=(
+            "Benchmark tiled, thread-parallel optical flow against whole-frame flow. "
+            "Reports the speedup and the magnitude error (overall, in the blended seams, and in tile interiors) "
+            "relative to the mean whole-frame magnitude. Uses synthetic frames unless two TIFs are given."
+        )
+    )
+    parser.add_argument("--frames", nargs=2, type=Path, help="Two consecutive TIF frames to compare")
+    parser.add_argument("--size", type=int, default=4096, help="Side length of synthetic frames (default: 4096)")
+    parser.add_argument("--tile-sizes", type=int, nargs="+", default=[512, 1024, 2048], help="Tile sizes to test")
+    parser.add_argument("--tile-overlap", type=int, default=64, help="Tile overlap in pixels (default: 64)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Thread pool size (default: all cores)")
+    parser.add_argument("--repeats", type=int, default=1, help="Timing repeats, best is reported (default: 1)")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    if args.frames:
+        frame1, frame2 = read_tif_stack(args.frames)
+    else:
+        frame1, frame2 = synthetic_worm_frames(2, args.size, args.size, n_worms=400)
+    benchmark(frame1, frame2, args.tile_sizes, args.tile_overlap, args.workers, args.repeats)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,81 @@
+import argparse
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from benchmark_utils import synthetic_worm_frames, time_call
+from pipelines.segmentation import create_circular_mask, python_edge_binary
+
+
+def load_images(tifs, n_images, size):
+    """Read the TIFs as the segmentation pipeline does, or generate synthetic frames."""
+    if tifs:
+        return [(tif.name, cv2.imread(str(tif), cv2.IMREAD_ANYDEPTH)) for tif in tifs]
+    frames = synthetic_worm_frames(n_images, size, size, n_worms=20, seed=0)
+    return [(f"synthetic_{i:03d}", frame) for i, frame in enumerate(frames)]
+
+
+def compare_binaries(reference, other):
+    """Return the fraction of pixels that differ and the IoU of the two foregrounds."""
+    differing = float(np.mean(reference != other))
+    union = np.logical_or(reference, other).sum()
+    iou = float(np.logical_and(reference, other).sum() / union) if union else 1.0
+    return differing, iou
+
+
+def benchmark(images, sigma, tolerance, repeats):
+    """
+    Build the python model's masked binary image with both backends and report the runtimes and how far the
+    'opencv' binary is from the 'skimage' binary. Returns the number of images outside the tolerance.
+    """
+    print(f"{'image':>24} {'skimage_ms':>10} {'opencv_ms':>9} {'speedup':>8} {'diff_px':>9} {'iou':>7} {'area_ratio':>10}  result")
+    failures = 0
+    for name, image in images:
+        height, width = image.shape
+        mask = create_circular_mask(height, width, radius=height / 2.2)
+
+        base_s, reference = time_call(python_edge_binary, image, sigma, "skimage", repeats=repeats)
+        fast_s, other = time_call(python_edge_binary, image, sigma, "opencv", repeats=repeats)
+        reference, other = reference * mask, other * mask
+
+        differing, iou = compare_binaries(reference, other)
+        area_ratio = other.sum() / reference.sum() if reference.sum() else float("nan")
+        passed = differing <= tolerance
+        failures += not passed
+        print(f"{name[-24:]:>24} {1000 * base_s:>10.1f} {1000 * fast_s:>9.1f} {base_s / fast_s:>8.2f} {differing:>9.3%} "
+              f"{iou:>7.4f} {area_ratio:>10.4f}  {'ok' if passed else 'FAIL'}")
+
+    print(f"{len(images) - failures} of {len(images)} images within {tolerance:.3%} differing pixels")
+    return failures
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description=(
+            "Compare the python segmentation model's backends (python_backend: skimage vs. opencv): runtime of the "
+            "blur, Sobel and Otsu steps, and a tolerance report of the opencv binary images against the skimage "
+            "ones. Exits with status 1 if any image differs by more than the tolerance. Uses synthetic frames "
+            "unless TIFs are given."
+        )
+    )
+    parser.add_argument("--tifs", nargs="+", type=Path, help="TIF images to segment (e.g. TimePoint_1 of a plate)")
+    parser.add_argument("--n-images", type=int, default=8, help="Synthetic images (default: 8)")
+    parser.add_argument("--size", type=int, default=2048, help="Side length of synthetic images (default: 2048)")
+    parser.add_argument("--sigma", type=float, default=0.25, help="model_sigma, as in master.yml (default: 0.25)")
+    parser.add_argument("--tolerance", type=float, default=0.001,
+                        help="Maximum fraction of differing pixels per image (default: 0.001)")
+    parser.add_argument("--repeats", type=int, default=3, help="Timing repeats; the best is reported (default: 3)")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    images = load_images(args.tifs, args.n_images, args.size)
+    failures = benchmark(images, args.sigma, args.tolerance, args.repeats)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
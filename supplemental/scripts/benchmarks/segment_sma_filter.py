@@ -0,0 +1,88 @@
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+from scipy import ndimage
+
+from benchmark_utils import time_call
+from pipelines.segmentation import segment_sma
+
+
+def loop_segment_sma(g, well_site, binary):
+    """The previous segment_sma: one full-image comparison per connected component."""
+    filled = ndimage.binary_fill_holes(binary)
+    nb_components, labelled_image, stats, centroids = cv2.connectedComponentsWithStats(filled.astype('uint8'), connectivity=8)
+    sizes = stats[1:, -1]
+    nb_components -= 1
+
+    min_size, max_size = 10, 500
+    bad_indices = []
+    filtered = np.zeros(labelled_image.shape, dtype=np.uint8)
+    for i in range(nb_components):
+        if min_size <= sizes[i] <= max_size:
+            filtered[labelled_image == i + 1] = 255
+        else:
+            bad_indices.append(i)
+    filtered_sizes = [j for i, j in enumerate(list(sizes)) if i not in bad_indices]
+
+    cv2.imwrite(str(Path(g.work) / "segmentation" / f"{g.plate}_{well_site}_filled.png"), filled.astype(np.uint8) * 255)
+    cv2.imwrite(str(Path(g.work) / "segmentation" / f"{g.plate}_{well_site}_filtered.png"), filtered.astype(np.uint8) * 255)
+    return filtered_sizes
+
+
+def synthetic_binary(size, n_objects, seed=0):
+    """A binary image of n_objects random blobs, from single-pixel debris to worm-sized objects."""
+    rng = np.random.default_rng(seed)
+    binary = np.zeros((size, size), dtype=np.uint8)
+    for x, y, radius in zip(rng.integers(0, size, n_objects), rng.integers(0, size, n_objects), rng.integers(1, 15, n_objects)):
+        cv2.circle(binary, (int(x), int(y)), int(radius), 1, -1)
+    return binary.astype(bool)
+
+
+def benchmark(binary, repeats):
+    """Time the previous and current segment_sma on the same image and check that their outputs are identical."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        g = SimpleNamespace(work=Path(temp_dir), plate="benchmark")
+        (g.work / "segmentation").mkdir()
+
+        loop_time, loop_sizes = time_call(loop_segment_sma, g, "loop", binary, repeats=repeats)
+        lut_time, lut_sizes = time_call(segment_sma, g, "lut", binary, repeats=repeats)
+
+        identical = loop_sizes == lut_sizes
+        for suffix in ("filled", "filtered"):
+            loop_png = (g.work / "segmentation" / f"benchmark_loop_{suffix}.png").read_bytes()
+            lut_png = (g.work / "segmentation" / f"benchmark_lut_{suffix}.png").read_bytes()
+            identical &= loop_png == lut_png
+
+    print(f"{binary.shape[1]}x{binary.shape[0]} image, {len(lut_sizes)} components kept")
+    print(f"loop segment_sma: {1000 * loop_time:.1f} ms")
+    print(f"LUT segment_sma:  {1000 * lut_time:.1f} ms")
+    print(f"speedup:          {loop_time / lut_time:.1f}x")
+    print(f"identical output: {identical}")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description=(
+            "Micro-benchmark of segment_sma: the previous per-component size filter loop vs. the lookup-table filter. "
+            "Checks that the returned sizes and the filled/filtered PNGs are identical."
+        )
+    )
+    parser.add_argument("--size", type=int, default=2048, help="Side length of the synthetic binary image (default: 2048)")
+    parser.add_argument("--n-objects", type=int, default=3000, help="Number of synthetic blobs (default: 3000)")
+    parser.add_argument("--repeats", type=int, default=3, help="Timing repeats, best is reported (default: 3)")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    benchmark(synthetic_binary(args.size, args.n_objects), args.repeats)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
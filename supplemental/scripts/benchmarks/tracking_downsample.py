@@ -0,0 +1,139 @@
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pandas as pd
+import trackpy as tp
+from scipy.spatial import cKDTree
+
+from benchmark_utils import synthetic_worm_frames
+from pipelines.tracking import close_locate_pool, locate_features
+
+# Default tracking settings from master.yml
+TRACKING_OPTIONS = {
+    "diameter": 15,
+    "minmass": 150,
+    "noisesize": 1,
+    "searchrange": 10,
+    "memory": 5,
+    "adaptivestop": 0.05,
+}
+
+
+def write_frames(frames, root):
+    """Write a (T, H, W) stack as one TIF per frame and return the paths in frame order."""
+    paths = []
+    for t, frame in enumerate(frames):
+        path = Path(root) / f"frame_{t:04d}.TIF"
+        cv2.imwrite(str(path), frame)
+        paths.append(path)
+    return paths
+
+
+def run_tracking(image_paths, options):
+    """Locate and link features as the tracking pipeline does and return (seconds, linked DataFrame)."""
+    start = time.perf_counter()
+    features = locate_features(image_paths, options)
+    linked = list(tp.link_df_iter(features, search_range=options["searchrange"], memory=options["memory"],
+                                  adaptive_stop=options["adaptivestop"]))
+    elapsed = time.perf_counter() - start
+    t = pd.concat(linked, ignore_index=True) if linked else pd.DataFrame(columns=["y", "x", "frame", "particle"])
+    return elapsed, t
+
+
+def compare_tracks(full, down, max_distance):
+    """
+    Match the downsampled features to the full-resolution features of the same frame (nearest neighbour within
+    max_distance pixels). Returns recall, precision, the RMS position error of the matches, and the track agreement:
+    the fraction of matched points whose downsampled track maps to the same full-resolution track as the majority
+    of that track's points.
+    """
+    matches = []
+    for frame, full_frame in full.groupby("frame"):
+        down_frame = down[down["frame"] == frame]
+        if down_frame.empty:
+            continue
+        distance, index = cKDTree(full_frame[["x", "y"]].to_numpy()).query(
+            down_frame[["x", "y"]].to_numpy(), distance_upper_bound=max_distance
+        )
+        found = np.isfinite(distance)
+        matches.append(pd.DataFrame({
+            "distance": distance[found],
+            "down_particle": down_frame["particle"].to_numpy()[found],
+            "full_particle": full_frame["particle"].to_numpy()[index[found]],
+        }))
+    matches = pd.concat(matches, ignore_index=True) if matches else pd.DataFrame(columns=["distance", "down_particle", "full_particle"])
+
+    if matches.empty:
+        return 0.0, 0.0, float("nan"), 0.0
+    majority = matches.groupby("down_particle")["full_particle"].agg(lambda p: p.value_counts().idxmax())
+    agreement = float((matches["full_particle"] == matches["down_particle"].map(majority)).mean())
+    rms_error = float(np.sqrt(np.mean(matches["distance"].to_numpy(dtype=float) ** 2)))
+    return len(matches) / max(1, len(full)), len(matches) / max(1, len(down)), rms_error, agreement
+
+
+def benchmark(image_paths, factors, processes):
+    """Track the frames at full resolution and at each downsample factor and report speed and agreement."""
+    full_options = dict(TRACKING_OPTIONS, downsample=1, processes=processes)
+    full_time, full = run_tracking(image_paths, full_options)
+    print(f"{len(image_paths)} frames: full resolution {full_time:.2f} s, "
+          f"{len(full)} features in {full['particle'].nunique()} tracks")
+
+    results = []
+    for factor in factors:
+        options = dict(TRACKING_OPTIONS, downsample=factor, processes=processes)
+        down_time, down = run_tracking(image_paths, options)
+        recall, precision, rms_error, agreement = compare_tracks(full, down, TRACKING_OPTIONS["diameter"] / 2)
+        results.append({
+            "downsample": factor,
+            "time_s": down_time,
+            "speedup": full_time / down_time,
+            "tracks": down["particle"].nunique(),
+            "recall": recall,
+            "precision": precision,
+            "rms_error_px": rms_error,
+            "track_agreement": agreement,
+        })
+    close_locate_pool()
+
+    print(f"{'factor':>6} {'time_s':>8} {'speedup':>8} {'tracks':>7} {'recall':>7} {'precision':>9} {'rms_px':>7} {'agreement':>9}")
+    for r in results:
+        print(f"{r['downsample']:>6} {r['time_s']:>8.2f} {r['speedup']:>8.2f} {r['tracks']:>7} {r['recall']:>7.1%} "
+              f"{r['precision']:>9.1%} {r['rms_error_px']:>7.2f} {r['track_agreement']:>9.1%}")
+    return results
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description=(
+            "Benchmark downsampled tracking (downsample) against full-resolution tracking. Reports the speedup, "
+            "the recall/precision and RMS position error of the located features, and how often matched points "
+            "fall on the same track. Uses synthetic frames unless TIFs are given."
+        )
+    )
+    parser.add_argument("--frames", nargs="+", type=Path, help="TIF frames of one well, in timepoint order")
+    parser.add_argument("--n-frames", type=int, default=20, help="Synthetic timepoints (default: 20)")
+    parser.add_argument("--size", type=int, default=2048, help="Side length of synthetic frames (default: 2048)")
+    parser.add_argument("--factors", type=int, nargs="+", default=[2, 3, 4], help="Downsample factors to test")
+    parser.add_argument("--processes", default=1, help="Locate processes, as in master.yml (default: 1)")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    processes = args.processes if args.processes == "auto" else int(args.processes)
+    if args.frames:
+        benchmark(args.frames, args.factors, processes)
+        return 0
+    with tempfile.TemporaryDirectory() as temp_dir:
+        frames = synthetic_worm_frames(args.n_frames, args.size, args.size, n_worms=60, speed=3.0)
+        benchmark(write_frames(frames, temp_dir), args.factors, processes)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,78 @@
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+
+from benchmark_utils import synthetic_worm_frames
+from pipelines.segmentation import get_yolo_model, rescale_tif_for_yolo
+
+
+def prepare_images(tifs, root, n_images, size):
+    """Rescale TIFs (or synthetic frames) to YOLO input arrays as the segmentation pipeline does."""
+    if not tifs:
+        tifs = []
+        for i, frame in enumerate(synthetic_worm_frames(n_images, size, size, n_worms=20, seed=0)):
+            tif = Path(root) / f"synthetic_{i:03d}.TIF"
+            cv2.imwrite(str(tif), frame)
+            tifs.append(tif)
+    return [rescale_tif_for_yolo(tif) for tif in tifs]
+
+
+def benchmark(model, images, batch_sizes, device):
+    """Predict all images at each batch size and report the per-image latency and throughput."""
+    # Warm up so that model fusing and predictor setup are not timed
+    model.predict(source=images[:1], device=device, verbose=False)
+
+    results = []
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        for batch_start in range(0, len(images), batch_size):
+            batch = images[batch_start:batch_start + batch_size]
+            model.predict(source=batch, batch=len(batch), device=device, verbose=False)
+        elapsed = time.perf_counter() - start
+        results.append({
+            "batch_size": batch_size,
+            "time_s": elapsed,
+            "ms_per_image": 1000 * elapsed / len(images),
+            "images_per_s": len(images) / elapsed,
+        })
+
+    base = results[0]["ms_per_image"]
+    print(f"{len(images)} images on {device}")
+    print(f"{'batch':>6} {'time_s':>8} {'ms/image':>9} {'images/s':>9} {'speedup':>8}")
+    for r in results:
+        print(f"{r['batch_size']:>6} {r['time_s']:>8.2f} {r['ms_per_image']:>9.1f} {r['images_per_s']:>9.2f} "
+              f"{base / r['ms_per_image']:>8.2f}")
+    return results
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description=(
+            "Measure YOLO per-image latency against batch size (segmentation yolo_mode: 'plate', yolo_batch_size). "
+            "Uses synthetic frames unless TIFs are given."
+        )
+    )
+    parser.add_argument("--model", type=Path, required=True, help="YOLO segmentation weights (e.g. pipelines/models/yolo/<model>)")
+    parser.add_argument("--tifs", nargs="+", type=Path, help="TIF images to predict (e.g. TimePoint_1 of a plate)")
+    parser.add_argument("--n-images", type=int, default=32, help="Synthetic images (default: 32)")
+    parser.add_argument("--size", type=int, default=1024, help="Side length of synthetic images (default: 1024)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="Batch sizes to test")
+    parser.add_argument("--device", default="cpu", help="Inference device (default: cpu)")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    model = get_yolo_model(args.model.resolve())
+    with tempfile.TemporaryDirectory() as temp_dir:
+        images = prepare_images(args.tifs, temp_dir, args.n_images, args.size)
+        benchmark(model, images, sorted(args.batch_sizes), args.device)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
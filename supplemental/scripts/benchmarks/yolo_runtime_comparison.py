@@ -0,0 +1,93 @@
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from yolo_batch_latency import prepare_images
+from pipelines.segmentation import export_yolo_model, get_yolo_model
+
+
+def predict_masks(model, images, device):
+    """Predict each image on its own and return (ms per image, list of (N, H, W) boolean mask stacks at image size)."""
+    model.predict(source=images[0], device=device, verbose=False)  # warm up
+    masks = []
+    start = time.perf_counter()
+    for image in images:
+        result = model.predict(source=image, device=device, retina_masks=True, verbose=False)[0]
+        masks.append(result.masks.data.cpu().numpy() > 0.5 if result.masks else np.zeros((0,) + image.shape[:2], dtype=bool))
+    elapsed = time.perf_counter() - start
+    return 1000 * elapsed / len(images), masks
+
+
+def mask_agreement(reference, other):
+    """
+    Compare two mask stacks of the same image. Returns the IoU of the segmented foreground and the mean best-match IoU
+    of the reference objects (each reference mask matched to the candidate mask it overlaps most).
+    """
+    ref_fg, other_fg = reference.any(axis=0), other.any(axis=0)
+    union = np.logical_or(ref_fg, other_fg).sum()
+    foreground_iou = np.logical_and(ref_fg, other_fg).sum() / union if union else 1.0
+    if not len(reference) or not len(other):
+        return foreground_iou, 1.0 if len(reference) == len(other) else 0.0
+
+    ref_flat = reference.reshape(len(reference), -1).astype(np.float32)
+    other_flat = other.reshape(len(other), -1).astype(np.float32)
+    intersection = ref_flat @ other_flat.T
+    unions = ref_flat.sum(axis=1)[:, None] + other_flat.sum(axis=1)[None, :] - intersection
+    ious = np.divide(intersection, unions, out=np.zeros_like(intersection), where=unions > 0)
+    return foreground_iou, float(ious.max(axis=1).mean())
+
+
+def benchmark(model_path, images, runtimes, device):
+    """Run every runtime over the images and report latency and mask agreement with the .pt model."""
+    base_ms, base_masks = predict_masks(get_yolo_model(model_path), images, device)
+    rows = [{"runtime": "pt", "ms_per_image": base_ms, "speedup": 1.0, "objects": sum(len(m) for m in base_masks),
+             "foreground_iou": 1.0, "object_iou": 1.0}]
+
+    for runtime in runtimes:
+        name, int8 = runtime.replace("-int8", ""), runtime.endswith("-int8")
+        export_path = export_yolo_model(model_path, name, int8)
+        ms, masks = predict_masks(get_yolo_model(export_path), images, device)
+        agreement = np.array([mask_agreement(ref, other) for ref, other in zip(base_masks, masks)])
+        rows.append({"runtime": runtime, "ms_per_image": ms, "speedup": base_ms / ms, "objects": sum(len(m) for m in masks),
+                     "foreground_iou": float(agreement[:, 0].mean()), "object_iou": float(agreement[:, 1].mean())})
+
+    print(f"{len(images)} images on {device}")
+    print(f"{'runtime':>14} {'ms/image':>9} {'speedup':>8} {'objects':>8} {'fg_iou':>7} {'obj_iou':>8}")
+    for r in rows:
+        print(f"{r['runtime']:>14} {r['ms_per_image']:>9.1f} {r['speedup']:>8.2f} {r['objects']:>8} "
+              f"{r['foreground_iou']:>7.3f} {r['object_iou']:>8.3f}")
+    return rows
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description=(
+            "Compare YOLO inference runtimes (segmentation yolo_runtime / yolo_int8) with the PyTorch .pt model: "
+            "per-image latency, foreground IoU and mean per-object IoU of the masks. Exports are created next to the "
+            "weights if they do not exist. Uses synthetic frames unless TIFs are given."
+        )
+    )
+    parser.add_argument("--model", type=Path, required=True, help="YOLO segmentation .pt weights (e.g. pipelines/models/yolo/<model>)")
+    parser.add_argument("--tifs", nargs="+", type=Path, help="TIF images to predict (e.g. TimePoint_1 of a plate)")
+    parser.add_argument("--n-images", type=int, default=16, help="Synthetic images (default: 16)")
+    parser.add_argument("--size", type=int, default=1024, help="Side length of synthetic images (default: 1024)")
+    parser.add_argument("--runtimes", nargs="+", default=["onnx", "openvino", "openvino-int8"],
+                        choices=["onnx", "openvino", "openvino-int8"], help="Runtimes to compare with .pt")
+    parser.add_argument("--device", default="cpu", help="Inference device (default: cpu)")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        images = prepare_images(args.tifs, temp_dir, args.n_images, args.size)
+        benchmark(args.model.resolve(), images, args.runtimes, args.device)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
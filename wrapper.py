@@ -25,9 +25,10 @@ from preprocessing.image_processing import (
 )
 from pipelines.diagnostics import static_dx, video_dx
 from pipelines.optical_flow import optical_flow
-from pipelines.segmentation import segmentation
-from pipelines.cellprofiler import cellprofiler
-from pipelines.tracking import tracking
+from pipelines.frame_difference import estimate_diff_thresholds, frame_difference
+from pipelines.segmentation import segmentation, segmentation_cellpose_plate, segmentation_yolo_plate, stitch_yolo_predictions, warm_yolo_model
+from pipelines.cellprofiler import cellprofiler, cellprofiler_cellpose_plate, cellprofiler_plate
+from pipelines.tracking import tracking, close_locate_pool
 
 if __name__ == "__main__":
 
@@ -155,6 +156,31 @@ if __name__ == "__main__":
             pipelines["video_dx"]["rescale_multiplier"],
         )
 
+    # Load the YOLO model once before processing well_sites
+    if "segmentation" in pipelines:
+        warm_yolo_model(pipelines["segmentation"])
+
+    # Plate-level YOLO segmentation runs once for all well_sites after the well_site loop
+    yolo_plate_mode = (
+        "segmentation" in pipelines
+        and pipelines["segmentation"]["model_type"] == "yolo"
+        and pipelines["segmentation"].get("yolo_mode", "well") == "plate"
+    )
+
+    # Plate-level Cellpose: segment the images of all well_sites in a single Cellpose run (per selected timepoint)
+    if (
+        "segmentation" in pipelines
+        and pipelines["segmentation"]["model_type"] == "cellpose"
+        and pipelines["segmentation"].get("cellpose_mode", "subprocess") == "plate"
+    ):
+        segmentation_cellpose_plate(g, pipelines["segmentation"], well_sites)
+    if "cellprofiler" in pipelines and pipelines["cellprofiler"].get("cellpose_mode", "subprocess") == "plate":
+        cellprofiler_cellpose_plate(g, pipelines["cellprofiler"], well_sites)
+
+    # Estimate the frame_difference noise threshold once for the plate, so all well_sites share it
+    if "frame_difference" in pipelines:
+        estimate_diff_thresholds(g, pipelines["frame_difference"], well_sites)
+
     wavelengths_dict = {}  # Dictionary to store wavelengths for each pipeline
     well_site_num = 1  # counter for well_sites
 
@@ -164,7 +190,11 @@ if __name__ == "__main__":
             wavelengths = optical_flow(g, pipelines["optical_flow"], well_site, multiplier=2)
             wavelengths_dict["optical_flow"] = wavelengths
 
-        if "segmentation" in pipelines:
+        if "frame_difference" in pipelines:
+            wavelengths = frame_difference(g, pipelines["frame_difference"], well_site, multiplier=2)
+            wavelengths_dict["frame_difference"] = wavelengths
+
+        if "segmentation" in pipelines and not yolo_plate_mode:
             wavelengths = segmentation(g, pipelines["segmentation"], well_site)
             wavelengths_dict["segmentation"] = wavelengths
 
@@ -178,6 +208,26 @@ if __name__ == "__main__":
 
         well_site_num += 1
 
+    if yolo_plate_mode:
+        wavelengths = segmentation_yolo_plate(g, pipelines["segmentation"], well_sites)
+        wavelengths_dict["segmentation"] = wavelengths
+
+    # Plate-level CellProfiler: run CellProfiler once on the combined file lists of all well_sites
+    if "cellprofiler" in pipelines and pipelines["cellprofiler"].get("cellprofiler_mode", "well") == "plate":
+        cellprofiler_plate(g, pipelines["cellprofiler"], well_sites)
+
+    # Stitch the YOLO prediction images of all wells once the whole plate has been segmented
+    if (
+        "segmentation" in pipelines
+        and pipelines["segmentation"]["model_type"] == "yolo"
+        and pipelines["segmentation"].get("save_predictions", True)
+    ):
+        stitch_yolo_predictions(g, wells, wavelengths_dict.get("segmentation", []), Path(g.output) / "segmentation")
+
+    # Shut down the trackpy locate pool shared by all well_sites
+    if "tracking" in pipelines:
+        close_locate_pool()
+
     # After running the pipelines, call static_dx with the correct wavelengths
     for pipeline in pipelines.keys():
         print(f"Running static_dx for {pipeline}.")